@@ -0,0 +1,61 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+DocumentStructure.detect_document_structure on a large synthetic charter
+
+  python -m benchmarks.bench_document_structure [lines]
+"""
+
+import sys
+import time
+
+from doc_structure import DocumentStructure
+
+SECTION = """Статья {n}. ОБЩИЕ ПОЛОЖЕНИЯ
+{n}.1. Акционерное общество «Газпром», именуемое в дальнейшем «Общество», создано в соответствии с законом.
+{n}.2. Место нахождения Общества: г. Москва, ул. Наметкина, д. 16.
+- Общество является юридическим лицом;
+- Общество вправе совершать сделки.
+{roman} РАЗДЕЛ
+Уставный капитал Общества составляет 3000 (Три тысячи) рублей.
+"""
+
+ROMANS = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X']
+
+
+def make_document(lines=20000):
+  section_lines = SECTION.count('\n')
+  sections = [SECTION.format(n=n % 40 + 1, roman=ROMANS[n % len(ROMANS)]) for n in range(lines // section_lines)]
+  return ''.join(sections)
+
+
+def _best_of(fn, repeat=3):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def run(lines=20000):
+  text = make_document(lines)
+  tokens = DocumentStructure().tokenize(text)
+
+  def detect():
+    structure = DocumentStructure()
+    structure.detect_document_structure(text)
+    return structure
+
+  elapsed, structure = _best_of(detect)
+
+  print(f'{text.count(chr(10))} lines, {len(text)} chars, {len(tokens)} tokens')
+  print(f'{len(structure.structure)} structure lines, {len(structure.headline_indexes)} headlines')
+  print(f'detect_document_structure: {elapsed:.3f}s')
+
+
+if __name__ == '__main__':
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
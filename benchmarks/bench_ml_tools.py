@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+ml_tools attention vector kernels: the per-element loops vs the vectorized versions, over document sizes
+
+  python -m benchmarks.bench_ml_tools [sizes...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from ml_tools import extremums, make_echo, momentum, momentum_, momentum_reversed, \
+  _extremums_loop, _make_echo_loop, _momentum_loop, _momentum__loop, _momentum_reversed_loop
+
+KERNELS = [
+  ('momentum', lambda x: momentum(x, 0.993), lambda x: _momentum_loop(x, 0.993)),
+  ('momentum (0.7)', lambda x: momentum(x, 0.7), lambda x: _momentum_loop(x, 0.7)),
+  ('momentum_reversed', lambda x: momentum_reversed(x, 0.95), lambda x: _momentum_reversed_loop(x, 0.95)),
+  ('momentum_', lambda x: momentum_(x, 0.99), lambda x: _momentum__loop(x, 0.99)),
+  ('make_echo', lambda x: make_echo(x, 0.5), lambda x: _make_echo_loop(x, 0.5)),
+  ('extremums', extremums, _extremums_loop),
+]
+
+
+def _best_of(fn, repeat=3):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def run(sizes=(1000, 10000, 100000)):
+  np.random.seed(0)
+  print(f'{"kernel":<20}{"tokens":>8}{"loop":>10}{"numpy":>10}{"speedup":>10}')
+  for size in sizes:
+    x = np.random.rand(size)
+    x[x < 0.8] = 0  # sparse, like a relu-ed attention vector
+
+    for name, vectorized, loop in KERNELS:
+      loop_time, expected = _best_of(lambda: loop(x))
+      numpy_time, result = _best_of(lambda: vectorized(x))
+
+      assert np.allclose(expected, result), name
+
+      print(f'{name:<20}{size:>8}{loop_time * 1000:>9.2f}ms{numpy_time * 1000:>8.2f}ms{loop_time / numpy_time:>9.0f}x')
+
+
+if __name__ == '__main__':
+  run([int(s) for s in sys.argv[1:]] or (1000, 10000, 100000))
@@ -0,0 +1,70 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+normalize_text: the sequential chain vs the fused rules on large documents;
+remove_table_of_contents on inputs that used to make its regex backtrack for minutes
+
+  python -m benchmarks.bench_normalize_text [pages]
+"""
+
+import sys
+import time
+
+from text_normalize import normalize_text, replacements_regex, fused_replacements_regex, remove_table_of_contents
+
+PAGE = """
+УСТАВ
+Акционерного Общества «Газпром»
+2019 г.
+1. ОБЩИЕ ПОЛОЖЕНИЯ
+1.1. Акционерное общество «Газпром» , именуемое в дальнейшем  «Общество», создано в соответствии с ФЗ от 26.12.1995.
+1.2. Место нахождения Общества: г.Москва, ул. Наметкина, д.16 .
+\tУставный капитал Общества составляет 3.000 (Три тысячи) руб. 00 коп., в т. ч. привилегированные акции.
+2. ПРАВОВОЙ СТАТУС ОБЩЕСТВА
+Общество является юридическим лицом.Общество вправе совершать сделки на сумму до 500 000 (пятьсот тысяч) рублей
+в соответствии с п.2.2.2 настоящего Устава , решением ООО  «Ромашка» и ЗАО «Лютик» от 2019г.
+ИП Иванов И.И. и АО «Лилия»
+"""
+
+
+TABLE_OF_CONTENTS_TEXTS = [
+  ('long gap', lambda n: 'содержание\n\n1.' + ' ' * (20 * n) + 'x'),
+  ('long table', lambda n: 'СОДЕРЖАНИЕ\n\n' + '1. Общие положения 3\n' * n),
+  ('many headers', lambda n: 'содержание\n \n1. а\n' * n),
+]
+
+
+def _best_of(fn, repeat=3):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def run(pages=200):
+  text = PAGE * pages
+
+  sequential_time, sequential = _best_of(lambda: normalize_text(text, replacements_regex))
+  fused_time, fused = _best_of(lambda: normalize_text(text, fused_replacements_regex))
+
+  assert sequential == fused, 'fused rules differ from the sequential chain'
+
+  print(f'{len(text)} chars, {len(replacements_regex)} rules in {len(fused_replacements_regex)} passes')
+  print(f'sequential: {sequential_time:.3f}s')
+  print(f'fused:      {fused_time:.3f}s  (x{sequential_time / fused_time:.2f})')
+
+  print(f'\nremove_table_of_contents{"n":>12}{"chars":>10}{"time":>10}')
+  for name, make_text in TABLE_OF_CONTENTS_TEXTS:
+    for n in (10000, 20000, 40000):
+      toc_text = make_text(n)
+      elapsed, _ = _best_of(lambda: remove_table_of_contents(toc_text))
+      print(f'{name:<24}{n:>12}{len(toc_text):>10}{elapsed * 1000:>8.1f}ms')
+
+
+if __name__ == '__main__':
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
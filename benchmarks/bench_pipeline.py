@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+analyze_contract one by one vs analyze_contracts (parse / embedd / analyze pipelined), with an embedder
+that, like TensorFlow, releases the GIL while it works
+
+  python -m benchmarks.bench_pipeline [documents] [embedding seconds per 1000 tokens]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from contract_parser import ContractAnlysingContext
+from embedding_tools import AbstractEmbedder
+from renderer import SilentRenderer
+
+CONTRACT = """ДОГОВОР ПОЖЕРТВОВАНИЯ
+1. ПРЕДМЕТ ДОГОВОРА
+1.1. Благотворитель передает Благополучателю в качестве пожертвования денежные средства.
+2. ЦЕНА ДОГОВОРА
+2.1. Сумма пожертвования составляет 1 000 000 (один миллион) рублей.
+3. ПРОЧИЕ УСЛОВИЯ
+""" + '3.{}. Стороны обязуются соблюдать условия настоящего договора и действующего законодательства.\n' * 60
+
+
+class SleepingEmbedder(AbstractEmbedder):
+
+  def __init__(self, seconds_per_1000_tokens):
+    self.seconds_per_1000_tokens = seconds_per_1000_tokens
+    self.points = {}
+
+  def embedd_tokenized_text(self, words, lens):
+    time.sleep(self.seconds_per_1000_tokens * np.sum(lens) / 1000)
+    emb = [[self._point(w) for w in s] for s in words]
+    return np.array(emb), words
+
+  def _point(self, word):
+    if word not in self.points:
+      self.points[word] = np.random.RandomState(sum(map(ord, word)) % 2 ** 31).randn(1024).astype(np.float32)
+    return self.points[word]
+
+
+def _best_of(fn, repeat=3):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def run(documents=8, seconds_per_1000_tokens=0.05):
+  texts = [CONTRACT.replace('{}', str(i)) for i in range(documents)]
+  ctx = ContractAnlysingContext(SleepingEmbedder(seconds_per_1000_tokens), SilentRenderer())
+
+  loop_time, expected = _best_of(lambda: [ctx.analyze_contract(t)[1] for t in texts])
+  pipeline_time, result = _best_of(lambda: [values for _, values in ctx.analyze_contracts(texts)])
+
+  assert [[v.value.value for v in values] for values in expected] == \
+         [[v.value.value for v in values] for values in result]
+
+  print(f'{"documents":>10}{"one by one":>12}{"pipelined":>12}{"speedup":>10}')
+  print(f'{documents:>10}{loop_time:>11.2f}s{pipeline_time:>11.2f}s{loop_time / pipeline_time:>9.2f}x')
+
+
+if __name__ == '__main__':
+  run(*[int(sys.argv[1])] if len(sys.argv) > 1 else [], *[float(sys.argv[2])] if len(sys.argv) > 2 else [])
@@ -0,0 +1,51 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+sentence_similarity_matrix: the pair-by-pair loop vs PAIRWISE_KERNELS, on random 1024-d section embeddings
+
+  python -m benchmarks.bench_sentence_similarity [sentences]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from text_tools import sentence_similarity_matrix, dist_mean_cosine, dist_frechet_cosine_undirected, \
+  dist_cosine_housedorff_undirected, dist_cosine_min_mean
+
+
+def _loop(emb, distance_function):
+  return np.array([[distance_function(u, v) for v in emb] for u in emb])
+
+
+def _best_of(fn, repeat=3):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def run(n=150, dim=1024):
+  np.random.seed(0)
+  sentences = [np.random.randn(l, dim) for l in np.random.randint(10, 60, n)]
+
+  print(f'{n} sentences, {sum(len(s) for s in sentences)} words')
+  print(f'{"distance":<36}{"loop":>10}{"matrix":>10}{"speedup":>10}')
+  for distance_function in [dist_mean_cosine, dist_frechet_cosine_undirected, dist_cosine_housedorff_undirected,
+                            dist_cosine_min_mean]:
+    loop_time, expected = _best_of(lambda: _loop(sentences, distance_function), repeat=1)
+    matrix_time, mtx = _best_of(lambda: sentence_similarity_matrix(sentences, distance_function))
+
+    assert np.allclose(expected, mtx, atol=0.01)
+
+    print(f'{distance_function.__name__:<36}{loop_time:>9.2f}s{matrix_time:>9.2f}s{loop_time / matrix_time:>9.0f}x')
+
+
+if __name__ == '__main__':
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 150)
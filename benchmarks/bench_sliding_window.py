@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+FuzzyPattern._eval_distances with the cdist-based distances: the per-token loop vs SLIDING_WINDOW_KERNELS,
+on random 1024-d document embeddings.
+The document is normalized once (normalize_text_rows) and passed to every kernel call as text_norm, as
+calculate_distances_per_pattern does for all patterns of a factory
+
+  python -m benchmarks.bench_sliding_window [tokens]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from text_tools import SLIDING_WINDOW_KERNELS, dist_frechet_cosine_undirected, dist_cosine_housedorff_undirected, \
+  dist_cosine_min_mean, normalize_text_rows
+
+
+def _loop(text_emb, pattern_emb, window_size, dist_function):
+  return np.array([dist_function(text_emb[i:i + window_size], pattern_emb) for i in range(len(text_emb))])
+
+
+def _best_of(fn, repeat=3):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def run(n=5000, dim=1024, pattern_len=6):
+  np.random.seed(0)
+  text_emb = np.random.randn(n, dim)
+  pattern_emb = np.random.randn(pattern_len, dim)
+  text_norm = normalize_text_rows(text_emb)
+
+  print(f'{n} tokens, pattern of {pattern_len} words')
+  print(f'{"distance":<36}{"loop":>10}{"kernel":>10}{"speedup":>10}')
+  for distance_function in [dist_frechet_cosine_undirected, dist_cosine_housedorff_undirected, dist_cosine_min_mean]:
+    kernel = SLIDING_WINDOW_KERNELS[distance_function]
+
+    loop_time, expected = _best_of(lambda: _loop(text_emb, pattern_emb, pattern_len, distance_function), repeat=1)
+    kernel_time, distances = _best_of(lambda: kernel(text_emb, pattern_emb, pattern_len, text_norm=text_norm))
+
+    assert np.allclose(expected, distances, atol=0.011)
+
+    print(f'{distance_function.__name__:<36}{loop_time:>9.2f}s{kernel_time:>9.3f}s{loop_time / kernel_time:>9.0f}x')
+
+
+if __name__ == '__main__':
+  run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+ml_tools.smooth: eval-ed window + np.convolve vs the cached window and FFT convolution,
+and smooth_rows on stacked attention vectors vs smoothing them one by one
+
+  python -m benchmarks.bench_smooth [sizes...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from ml_tools import smooth, smooth_rows
+
+
+def _smooth_eval_convolve(x, window_len, window='hanning'):
+  s = np.r_[x[window_len - 1:0:-1], x, x[-2:-window_len - 1:-1]]
+  w = eval('np.' + window + '(window_len)')
+  y = np.convolve(w / w.sum(), s, mode='valid')
+  return y[int(window_len / 2) - 1:-int(window_len / 2)]
+
+
+def _best_of(fn, repeat=3):
+  best = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def run(sizes=(1000, 10000, 100000), rows=32):
+  np.random.seed(0)
+  print(f'{"":<12}{"tokens":>8}{"window":>8}{"before":>12}{"after":>11}{"speedup":>10}')
+  for size in sizes:
+    x = np.random.rand(rows, size)
+    x[x < 0.8] = 0  # sparse, like a relu-ed attention vector
+
+    for window_len in [8, 60, 600, size // 10]:
+      before, expected = _best_of(lambda: _smooth_eval_convolve(x[0], window_len))
+      after, result = _best_of(lambda: smooth(x[0], window_len))
+      assert np.allclose(expected, result)
+      print(f'{"smooth":<12}{size:>8}{window_len:>8}{before * 1000:>10.3f}ms{after * 1000:>9.3f}ms{before / after:>9.1f}x')
+
+      before, expected = _best_of(lambda: np.array([_smooth_eval_convolve(row, window_len) for row in x]))
+      after, result = _best_of(lambda: smooth_rows(x, window_len))
+      assert np.allclose(expected, result)
+      print(f'{f"rows x{rows}":<12}{size:>8}{window_len:>8}{before * 1000:>10.3f}ms{after * 1000:>9.3f}ms{before / after:>9.1f}x')
+
+
+if __name__ == '__main__':
+  run([int(s) for s in sys.argv[1:]] or (1000, 10000, 100000))
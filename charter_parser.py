@@ -3,9 +3,9 @@
 from charter_patterns import make_constraints_attention_vectors
 from legal_docs import HeadlineMeta, LegalDocument, org_types, CharterDocument, extract_all_contraints_from_sentence, \
   deprecated, \
-  extract_all_contraints_from_sr
+  extract_all_contraints_from_sr, embedd_documents
 from ml_tools import *
-from parsing import ParsingSimpleContext, head_types_dict, known_subjects
+from parsing import ParsingSimpleContext, head_types_dict, known_subjects, run_pipeline
 from patterns import FuzzyPattern, find_ner_end, improve_attention_vector, AV_PREFIX, PatternSearchResult, \
   ConstraintsSearchResult, PatternSearchResults
 from sections_finder import SectionsFinder, FocusingSectionsFinder
@@ -47,7 +47,7 @@ class CharterConstraintsParser(ParsingSimpleContext):
     body.calculate_distances_per_pattern(self.pattern_factory, pattern_prefix='d_order_', merge=True)
 
     a_vectors = make_constraints_attention_vectors(body)
-    body.distances_per_pattern_dict = {**body.distances_per_pattern_dict, **a_vectors}
+    body.distances_per_pattern_dict.update(a_vectors)
 
     if self.verbosity_level > 1:
       print('extract_constraint_values_from_section', 'embedding....')
@@ -119,15 +119,53 @@ class CharterDocumentParser(CharterConstraintsParser):
     :param txt:
     """
 
-    self._reset_context()
-
     # 0. parse
     _charter_doc = CharterDocument(txt)
 
     # 1. find top level structure
     _charter_doc.parse()
     _charter_doc.embedd(self.pattern_factory)
-    self.doc: CharterDocument = _charter_doc
+
+    self._analyze_embedded_charter(_charter_doc)
+    return self.org, self.constraints
+
+  def analyze_charters(self, texts: List[str], batch_size=16, queue_size=1) -> List[CharterDocument]:
+    """
+    analyze_charter for many texts. Every batch_size documents are parsed, then embedded together
+    (see embedd_documents: length buckets across the documents, far fewer embedder calls),
+    then analyzed one by one. The three steps are pipelined (see parsing.run_pipeline): the next batch
+    is parsed and the current one is embedded while the previous one is analyzed. The embedder is called
+    from two threads at once, so it must be thread-safe.
+
+    :return: the analyzed documents, in the order of texts; see CharterDocument.org, .constraints_old
+    """
+    batches = (texts[b:b + batch_size] for b in range(0, len(texts), batch_size))
+
+    charters = []
+    for batch in run_pipeline(batches, [self._parse_charters, self._embedd_charters, self._analyze_embedded_charters],
+                              queue_size=queue_size):
+      charters += batch
+
+    return charters
+
+  def _parse_charters(self, texts: List[str]) -> List[CharterDocument]:
+    batch = [CharterDocument(txt) for txt in texts]
+    for charter in batch:
+      charter.parse()
+    return batch
+
+  def _embedd_charters(self, batch: List[CharterDocument]) -> List[CharterDocument]:
+    embedd_documents(batch, self.pattern_factory.embedder)
+    return batch
+
+  def _analyze_embedded_charters(self, batch: List[CharterDocument]) -> List[CharterDocument]:
+    for charter in batch:
+      self._analyze_embedded_charter(charter)
+    return batch
+
+  def _analyze_embedded_charter(self, charter: CharterDocument):
+    self._reset_context()
+    self.doc: CharterDocument = charter
 
     """ 2. ✂️ 📃 -> 📄📄📄  finding headlines (& sections) ==== ️"""
 
@@ -146,13 +184,12 @@ class CharterDocumentParser(CharterConstraintsParser):
     self.verbosity_level = 1
     self.log_warnings()
 
-    return self.org, self.constraints
-
   def _make_competence_attention_v(self):
     self.doc.calculate_distances_per_pattern(self.pattern_factory, pattern_prefix='competence', merge=True)
     filtered = filter_values_by_key_prefix(self.doc.distances_per_pattern_dict, 'competence')
     competence_v = rectifyed_sum(filtered, 0.3)
-    competence_v, c = improve_attention_vector(self.doc.embeddings, competence_v, mix=1)
+    competence_v, c = improve_attention_vector(self.doc.embeddings, competence_v, mix=1,
+                                               dtype=self.doc.precision.distances)
     return competence_v
 
   def ners(self):
@@ -11,8 +11,8 @@ from parsing import known_subjects
 
 class CharterPatternFactory(AbstractPatternFactoryLowCase):
 
-  def __init__(self, embedder):
-    AbstractPatternFactoryLowCase.__init__(self, embedder)
+  def __init__(self, embedder, embeddings_cache_path=None):
+    AbstractPatternFactoryLowCase.__init__(self, embedder, embeddings_cache_path)
 
     self.headlines = ['head.directors', 'head.all', 'head.gen', 'head.pravlenie', 'name']
 
@@ -5,7 +5,7 @@ from legal_docs import LegalDocument, HeadlineMeta, extract_all_contraints_from_
   extract_sum_and_sign_3, _expand_slice
 from ml_tools import ProbableValue, max_exclusive_pattern_by_prefix, relu, np, filter_values_by_key_prefix, \
   rectifyed_sum, TokensWithAttention
-from parsing import ParsingConfig, ParsingContext
+from parsing import ParsingConfig, ParsingContext, run_pipeline
 from patterns import AV_SOFT, AV_PREFIX
 from renderer import AbstractRenderer
 from sections_finder import SectionsFinder, FocusingSectionsFinder
@@ -26,10 +26,15 @@ class ContractDocument3(LegalDocument):
 
 class ContractAnlysingContext(ParsingContext):
 
-  def __init__(self, embedder, renderer: AbstractRenderer):
+  def __init__(self, embedder, renderer: AbstractRenderer, pattern_factory: ContractPatternFactory = None):
+    """
+    :param pattern_factory: already embedded patterns to reuse; by default they are built and embedded here
+    """
     ParsingContext.__init__(self, embedder)
     self.renderer: AbstractRenderer = renderer
-    self.pattern_factory = ContractPatternFactory(embedder)
+    if pattern_factory is None:
+      pattern_factory = ContractPatternFactory(embedder)
+    self.pattern_factory = pattern_factory
 
     self.contract = None
     # self.contract_values = None
@@ -58,13 +63,36 @@ class ContractAnlysingContext(ParsingContext):
     :param contract_text: 
     :return: 
     """
+    doc = self._parse_contract(contract_text)
+    self._embedd_contract(doc)
+    return self._analyze_embedded_contract(doc)
+
+  def analyze_contracts(self, texts, queue_size=1):
+    """
+    analyze_contract for many texts, pipelined (see parsing.run_pipeline): the next contract is parsed
+    and the current one is embedded while the previous one is analyzed. The embedder is called from two threads
+    at once, so it must be thread-safe.
+
+    :return: generator of (doc, values), in the order of texts
+    """
+    return run_pipeline(texts, [self._parse_contract, self._embedd_contract, self._analyze_embedded_contract],
+                        queue_size=queue_size)
+
+  def _parse_contract(self, contract_text) -> ContractDocument3:
     doc = ContractDocument3(contract_text)
     doc.parse()
+    return doc
+
+  def _embedd_contract(self, doc: ContractDocument3) -> ContractDocument3:
+    doc.embedd(self.pattern_factory)
+    return doc
+
+  def _analyze_embedded_contract(self, doc: ContractDocument3):
+    self._reset_context()
     self.contract = doc
 
     self._logstep("parsing document 👞 and detecting document high-level structure")
 
-    self.contract.embedd(self.pattern_factory)
     self.sections_finder.find_sections(doc, self.pattern_factory, self.pattern_factory.headlines,
                                        headline_patterns_prefix='headline.')
 
@@ -283,7 +311,7 @@ def _try_to_fetch_value_from_section_2(value_section: LegalDocument, factory: Co
 
   vectors = factory.make_contract_value_attention_vectors(value_section)
 
-  value_section.distances_per_pattern_dict = {**value_section.distances_per_pattern_dict, **vectors}
+  value_section.distances_per_pattern_dict.update(vectors)
 
   values: List[ProbableValue] = extract_all_contraints_from_sr_2(value_section,
                                                                  value_section.distances_per_pattern_dict[
@@ -335,7 +363,7 @@ def _try_to_fetch_value_from_section___(value_section: LegalDocument, factory: C
 
   vectors = factory.make_contract_value_attention_vectors(value_section)
 
-  value_section.distances_per_pattern_dict = {**value_section.distances_per_pattern_dict, **vectors}
+  value_section.distances_per_pattern_dict.update(vectors)
 
   values: List[ProbableValue] = extract_all_contraints_from_sentence(value_section,
                                                                      value_section.distances_per_pattern_dict[
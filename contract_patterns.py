@@ -6,8 +6,8 @@ from structures import ContractSubject
 
 class ContractPatternFactory(AbstractPatternFactoryLowCase):
 
-  def __init__(self, embedder):
-    AbstractPatternFactoryLowCase.__init__(self, embedder)
+  def __init__(self, embedder, embeddings_cache_path=None):
+    AbstractPatternFactoryLowCase.__init__(self, embedder, embeddings_cache_path)
     # self.headlines = ['subj', 'contract', 'def', 'price.', 'pricecond', 'terms', 'dates', 'break', 'rights', 'obl',
     #                   'resp', 'forcemajor', 'confidence', 'special', 'appl', 'addresses', 'conficts']
 
@@ -0,0 +1,263 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+"""
+Runs ContractAnlysingContext.analyze_contract over a corpus in a pool of worker processes.
+
+Every worker builds one embedder (with `embedder_factory`) and one embedded ContractPatternFactory
+and analyzes documents one after another; results are written to a JSON-lines file as they come,
+one line per document, failures and timeouts included:
+
+  {"id": ..., "ok": true, "seconds": 12.3, "warnings": [...], "result": {"subjects": [...], "values": [...]}}
+  {"id": ..., "ok": false, "seconds": 600.0, "error": "DocumentTimeout: ...", "traceback": "..."}
+
+Workers are spawned, not forked (TensorFlow does not survive a fork), so `embedder_factory` and `summarize`
+must be module-level functions. Each worker is one more TensorFlow runtime: on CPU-only machines limit
+its threads in `embedder_factory` (intra_op_parallelism_threads=1 or 2), and add workers instead.
+
+  run_corpus(read_text_files(paths), 'results.jsonl', make_elmo_embedder, workers=8)
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+DEFAULT_DOCUMENT_TIMEOUT = 600  # seconds
+
+
+class DocumentTimeout(BaseException):
+  """
+  A BaseException, like KeyboardInterrupt: the `except Exception` blocks of the analysis code must not swallow it
+  """
+  pass
+
+
+def read_text_files(paths, encoding='utf-8'):
+  """
+  :return: (path, text) pairs, reading files lazily
+  """
+  for path in paths:
+    with open(path, encoding=encoding) as f:
+      yield path, f.read()
+
+
+def summarize_contract(doc, values) -> dict:
+  """
+  JSON-friendly summary of what analyze_contract returns
+  """
+  return {
+    'subjects': [{'subject': s.value.name, 'confidence': float(s.confidence)} for s in doc.subjects],
+    'values': [{'value': float(v.value.value), 'currency': v.value.currency, 'sign': int(v.value.sign),
+                'confidence': float(v.confidence)} for v in values]
+  }
+
+
+# ----------------------------------------------------------------
+# WORKER
+# ----------------------------------------------------------------
+
+_worker_context = None
+_worker_summarize = None
+
+
+def _init_worker(embedder_factory, patterns_cache_path, summarize, quiet):
+  global _worker_context, _worker_summarize
+
+  if quiet:
+    sys.stdout = open(os.devnull, 'w')
+
+  from contract_parser import ContractAnlysingContext
+  from contract_patterns import ContractPatternFactory
+  from renderer import SilentRenderer
+
+  embedder = embedder_factory()
+  pattern_factory = ContractPatternFactory(embedder, patterns_cache_path)
+  _worker_context = ContractAnlysingContext(embedder, SilentRenderer(), pattern_factory)
+  _worker_summarize = summarize
+
+
+def _on_timeout(signum, frame):
+  raise DocumentTimeout('document analysis timed out')
+
+
+def _analyze(doc_id, text, timeout) -> dict:
+  start = time.time()
+  record = {'id': doc_id}
+
+  # SIGALRM interrupts the analysis as soon as control is back in Python (not inside a TensorFlow call)
+  use_alarm = timeout is not None and hasattr(signal, 'setitimer')
+  if use_alarm:
+    signal.signal(signal.SIGALRM, _on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+
+  try:
+    doc, values = _worker_context.analyze_contract(text)
+    record['ok'] = True
+    record['warnings'] = list(_worker_context.warnings)
+    record['result'] = _worker_summarize(doc, values)
+
+  except (Exception, DocumentTimeout) as e:
+    record['ok'] = False
+    record['error'] = f'{type(e).__name__}: {e}'
+    record['traceback'] = traceback.format_exc()
+
+  finally:
+    if use_alarm:
+      signal.setitimer(signal.ITIMER_REAL, 0)
+
+  record['seconds'] = round(time.time() - start, 3)
+  return record
+
+
+# ----------------------------------------------------------------
+# MAIN PROCESS
+# ----------------------------------------------------------------
+
+def _kill_workers(pool: ProcessPoolExecutor):
+  # there is no public API to stop a running task; the pool is replaced anyway
+  for process in list(pool._processes.values()):
+    process.kill()
+  pool.shutdown()
+
+
+def run_corpus(docs, output_path: str, embedder_factory, workers: int = None, timeout=DEFAULT_DOCUMENT_TIMEOUT,
+               patterns_cache_path: str = None, summarize=summarize_contract, quiet=True, max_pending: int = None,
+               kill_after: float = None):
+  """
+  The timeout is enforced twice. In the worker, SIGALRM interrupts the analysis as soon as control is back
+  in Python. A worker stuck in native code (a TensorFlow call) is not interrupted by it: when a document is not back
+  `kill_after` seconds after it was handed to a worker, the workers are killed, the document is recorded
+  as failed (DocumentTimeout) and the other documents in flight are run again in a new pool.
+
+  When a worker dies (out of memory, a crash in native code), the pool is broken and every document in flight
+  is lost with it: the pool is rebuilt and those documents are re-run one at a time, so only the one that kills
+  a worker on its own is recorded as failed ("WorkerDied").
+
+  :param docs: iterable of (document id, text); read lazily, at most max_pending documents are in flight
+  :param output_path: JSON-lines file, appended to
+  :param embedder_factory: module-level function making the embedder of a worker
+  :param workers: number of worker processes, os.cpu_count() by default
+  :param timeout: seconds per document, None for no limit
+  :param patterns_cache_path: pattern embeddings cache, so the patterns are embedded once, not once per worker
+  :param summarize: module-level function (doc, values) -> JSON-serializable result
+  :param quiet: silence the (chatty) analysis output of the workers
+  :param max_pending: 2 x workers by default
+  :param kill_after: seconds, 2 x timeout + 60 by default: a document handed to a worker may still wait
+  for the one before it
+  :return: number of documents processed, number of them failed
+  """
+  workers = workers or os.cpu_count()
+  max_pending = max_pending or 2 * workers
+  if kill_after is None and timeout is not None:
+    kill_after = 2 * timeout + 60
+
+  def _make_pool():
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker,
+                               initargs=(embedder_factory, patterns_cache_path, summarize, quiet))
+
+  processed = 0
+  failed = 0
+
+  with open(output_path, 'a', encoding='utf-8') as out:
+
+    def _write(record):
+      nonlocal processed, failed
+      out.write(json.dumps(record, ensure_ascii=False) + '\n')
+      out.flush()
+
+      processed += 1
+      if not record['ok']:
+        failed += 1
+
+    pool = _make_pool()
+    pending = {}  # future -> (document id, text, runs alone)
+    started = {}  # future -> when it was handed to a worker
+    retries = deque()  # (document id, text) in flight when the workers were killed for another document
+    suspects = deque()  # (document id, text) in flight when a worker died
+    docs = iter(docs)
+    exhausted = False
+
+    try:
+      while True:
+        if len(suspects) > 0:
+          if len(pending) == 0:
+            doc_id, text = suspects.popleft()
+            pending[pool.submit(_analyze, doc_id, text, timeout)] = (doc_id, text, True)
+        else:
+          while len(pending) < max_pending and (len(retries) > 0 or not exhausted):
+            try:
+              doc_id, text = retries.popleft() if len(retries) > 0 else next(docs)
+              pending[pool.submit(_analyze, doc_id, text, timeout)] = (doc_id, text, False)
+            except StopIteration:
+              exhausted = True
+
+        if len(pending) == 0:
+          break
+
+        poll = None
+        if kill_after is not None:
+          now = time.time()
+          for future in pending:
+            if future not in started and future.running():
+              started[future] = now
+          poll = min([started[f] + kill_after - now for f in started] + [1.0])
+
+        done, _ = wait(pending, timeout=max(poll, 0) if poll is not None else None, return_when=FIRST_COMPLETED)
+
+        if len(done) == 0:
+          now = time.time()
+          expired = [f for f in started if now - started[f] >= kill_after]
+          if len(expired) > 0:
+            _kill_workers(pool)
+            for future in list(pending):
+              doc_id, text, _ = pending.pop(future)
+              start = started.pop(future, None)
+              if future in expired:
+                _write({'id': doc_id, 'ok': False, 'seconds': round(now - start, 3),
+                        'error': f'DocumentTimeout: the worker did not come back in {kill_after} seconds'})
+              elif future.done() and future.exception() is None:
+                _write(future.result())
+              else:
+                retries.append((doc_id, text))
+            pool = _make_pool()
+          continue
+
+        if any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+          # the other futures fail with the pool too, if they have not completed yet
+          done, _ = wait(pending)
+
+        broken = False
+        for future in done:
+          doc_id, text, alone = pending.pop(future)
+          started.pop(future, None)
+          try:
+            record = future.result()
+          except BrokenProcessPool as e:
+            broken = True
+            if not alone:
+              suspects.append((doc_id, text))
+              continue
+            record = {'id': doc_id, 'ok': False, 'error': f'WorkerDied: {e}'}
+          except (Exception, DocumentTimeout) as e:
+            # the result could not be pickled, or the alarm went off outside of the analysis
+            record = {'id': doc_id, 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+          _write(record)
+
+        if broken:
+          pool.shutdown()
+          pool = _make_pool()
+
+    finally:
+      pool.shutdown()
+
+  return processed, failed
@@ -34,7 +34,7 @@ class ProtocolDocument(BasicContractDocument):
       'min': sums[min_i],
     }
 
-    start, end = get_sentence_bounds_at_index(min_i, self.tokens)
+    start, end = get_sentence_bounds_at_index(min_i, self.tokens, self.newlines)
     sentence_tokens = self.tokens[start + 1:end]
 
     f, sentence = extract_sum_from_tokens(sentence_tokens)
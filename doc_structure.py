@@ -1,7 +1,7 @@
 import re
 
 from ml_tools import *
-from text_tools import tokenize_text, np, untokenize
+from text_tools import tokenize_text, tokenize_text_fast, np, untokenize
 
 
 def _strip_left(tokens):
@@ -37,7 +37,7 @@ def check_valid_roman(roman):
 def roman_might_be(wrd):
   try:
     return roman_to_arabic(wrd)
-  except:
+  except Exception:
     return None
 
 
@@ -47,7 +47,7 @@ def string_to_ip(str):
   for c in n:
     try:
       ret.append(int(c))
-    except:
+    except Exception:
       pass
   return ret
 
@@ -186,17 +186,29 @@ class StructureLine():
 
 class DocumentStructure:
 
-  def __init__(self):
+  def __init__(self, tokenizer=tokenize_text_fast):
+    """
+    :param tokenizer: text -> tokens, '\n' included; tokenize_text_fast gives the same tokens as tokenize_text (nltk)
+    """
     self.structure: List[StructureLine] = None
     self.headline_indexes = []
+    self.tokenizer = tokenizer
     # self._detect_document_structure(text)
 
   def tokenize(self, _txt):
-    return tokenize_text(_txt)
+    return self.tokenizer(_txt)
 
   def detect_document_structure(self, text):
     lines: List[str] = text.split('\n')
 
+    # the whole document is tokenized at once, then split back into lines
+    lines_tokens = [[]]
+    for token in self.tokenize('\n'.join([row.strip() for row in lines])):
+      if token == '\n':
+        lines_tokens.append([])
+      else:
+        lines_tokens[-1].append(token)
+
     last_level_known = 0
 
     structure = []
@@ -207,9 +219,9 @@ class DocumentStructure:
     index = 0
     romans = 0
     maxroman = 0
-    for __row in lines:
+    for __row_tokens in lines_tokens:
 
-      line_tokens_cc = self.tokenize(__row.strip()) + ['\n']
+      line_tokens_cc = __row_tokens + ['\n']
 
       line_tokens = [s.lower() for s in line_tokens_cc]
       tokens_cc += line_tokens_cc
@@ -246,18 +258,18 @@ class DocumentStructure:
         structure.append(section_meta)
         index = len(tokens)
 
-      if romans < 3:
-        # not enough roman numbers, so these are not roman
-        for s in structure:
-          if s.roman:
-            s.number = []
-            s.level = max(2, s.level + 1)
-
-      elif romans > 40:
-        # too many, does not look like top-level
-        for s in structure:
-          if s.roman:
-            s.level = max(2, s.level)
+    if romans < 3:
+      # not enough roman numbers, so these are not roman
+      for s in structure:
+        if s.roman:
+          s.number = []
+          s.level = max(2, s.level + 1)
+
+    elif romans > 40:
+      # too many, does not look like top-level
+      for s in structure:
+        if s.roman:
+          s.level = max(2, s.level)
 
     self.structure = self._fix_structure(structure)
 
@@ -1,4 +1,9 @@
 import gc
+import hashlib
+import itertools
+import json
+import os
+import threading
 from abc import abstractmethod
 
 from text_tools import *
@@ -6,29 +11,70 @@ from text_tools import *
 import time
 
 
-def embedd_tokenized_sentences_list(embedder, tokenized_sentences_list):
-  maxlen = 0
-  lens = []
+# max number of (padded) tokens sent to the embedder in one call
+BATCH_TOKENS_BUDGET = 6000
+
+
+def make_length_buckets(lens: List[int], max_batch_tokens=BATCH_TOKENS_BUDGET) -> List[List[int]]:
+  """
+  Groups sentences of similar length, so short ones are not padded up to the longest one in the list.
+
+  :param lens: sentence lengths
+  :return: lists of sentence indexes; in each bucket, (number of sentences x longest sentence) fits
+  into max_batch_tokens, unless the bucket is a single sentence longer than that
+  """
+  buckets = []
+  bucket = []
+  for i in sorted(range(len(lens)), key=lambda i: lens[i]):
+    # sorted by length, so lens[i] is the padded length of the bucket
+    if len(bucket) > 0 and (len(bucket) + 1) * max(1, lens[i]) > max_batch_tokens:
+      buckets.append(bucket)
+      bucket = []
+    bucket.append(i)
+
+  if len(bucket) > 0:
+    buckets.append(bucket)
+
+  return buckets
+
 
-  for s in tokenized_sentences_list:
-    lens.append(len(s))
-    if len(s) > maxlen:
-      maxlen = len(s)
+def embedd_tokenized_sentences_bucketed(embedder, tokenized_sentences_list, max_batch_tokens=BATCH_TOKENS_BUDGET):
+  """
+  Embeds sentences in length buckets (see make_length_buckets), one embedder call per bucket.
+  The input lists are not modified.
 
-  _strings = []
-  for i in range(len(tokenized_sentences_list)):
-    s = tokenized_sentences_list[i]
-    s.extend([' '] * (maxlen - len(s)))
-    _strings.append(s)
+  :return: (embeddings, tokens, lens), in the order of the input;
+  embeddings[i] is lens[i] x dim, tokens[i] is the i-th sentence tokens
+  """
+  lens = [len(s) for s in tokenized_sentences_list]
 
-  _strings = np.array(_strings)
+  sentences_emb = [None] * len(tokenized_sentences_list)
+  wrds = [None] * len(tokenized_sentences_list)
+
+  for bucket in make_length_buckets(lens, max_batch_tokens):
+    maxlen = max([lens[i] for i in bucket])
+
+    _strings = []
+    for i in bucket:
+      s = tokenized_sentences_list[i]
+      _strings.append(list(s) + [' '] * (maxlen - lens[i]))
+    _strings = np.array(_strings)
+
+    ## ======== call TENSORFLOW -----==================
+    bucket_emb, _ = embedder.embedd_tokenized_text(_strings, [lens[i] for i in bucket])
+    ## ================================================
+
+    for j, i in enumerate(bucket):
+      sentences_emb[i] = bucket_emb[j][0:lens[i]]
+      wrds[i] = list(tokenized_sentences_list[i])
 
-  ## ======== call TENSORFLOW -----==================
-  sentences_emb, wrds = embedder.embedd_tokenized_text(_strings, lens)
-  ## ================================================
   return sentences_emb, wrds, lens
 
 
+def embedd_tokenized_sentences_list(embedder, tokenized_sentences_list):
+  return embedd_tokenized_sentences_bucketed(embedder, tokenized_sentences_list)
+
+
 class AbstractEmbedder:
 
   @abstractmethod
@@ -39,20 +85,22 @@ class AbstractEmbedder:
   def embedd_tokenized_text(self, words, lens):
     pass
 
+  def get_embedder_id(self) -> str:
+    """
+    identity of the model and the layer; embedding caches use it as a part of the key.
+    None if the model is not known: then nothing is cached
+    """
+    return f'{type(self).__name__}:{getattr(self, "layer_name", "")}'
+
   def embedd_sentence(self, _str):
     words = tokenize_text(_str)
     return self.embedd_tokenized_text([words], [len(words)])
 
   def embedd_contextualized_patterns(self, patterns):
     tokenized_sentences_list = []
-    regions = {}
+    regions = []
 
-    i = 0
-    maxlen = 0
-    lens = []
     for (ctx_prefix, pattern, ctx_postfix) in patterns:
-      sentence = ' '.join((ctx_prefix, pattern, ctx_postfix))
-
       prefix_tokens = tokenize_text(ctx_prefix)
       pattern_tokens = tokenize_text(pattern)
       suffix_tokens = tokenize_text(ctx_postfix)
@@ -64,33 +112,16 @@ class AbstractEmbedder:
 
       # print('embedd_contextualized_patterns', (sentence, start, end))
 
-      regions[i] = (start, end)
+      regions.append((start, end))
       tokenized_sentences_list.append(sentence_tokens)
-      lens.append(len(sentence_tokens))
-      if len(sentence_tokens) > maxlen:
-        maxlen = len(sentence_tokens)
-
-      i = i + 1
-
-    # print('maxlen=', maxlen)
-    _strings = []
-
-    for s in tokenized_sentences_list:
-      s.extend([' '] * (maxlen - len(s)))
-      _strings.append(s)
-      # print(s)
-    _strings = np.array(_strings)
 
     ## ======== call TENSORFLOW -----==================
-    sentences_emb, wrds = self.embedd_tokenized_text(_strings, lens)
+    sentences_emb, wrds, lens = embedd_tokenized_sentences_bucketed(self, tokenized_sentences_list)
     ## ================================================
 
-    # print(sentences_emb.shape)
-    #     assert len(sentence_tokens) == sentences_emb
-
     patterns_emb = []
 
-    for i in regions:
+    for i in range(len(regions)):
       start, end = regions[i]
 
       sentence_emb = sentences_emb[i]
@@ -101,9 +132,130 @@ class AbstractEmbedder:
     return np.array(patterns_emb)
 
 
+class CachingEmbedder(AbstractEmbedder):
+  """
+  Content-addressed on-disk cache in front of another embedder.
+
+  Every sentence is keyed by a hash of its tokens and `embedder_id` (put the model and the layer name there),
+  and is stored as a `{key}.npy` file. Hits are read memory-mapped; only misses go to the wrapped embedder.
+  When the cache directory grows over `max_size_bytes`, least recently used files are deleted.
+  Safe to share between threads (see parsing.run_pipeline) if the wrapped embedder is.
+  """
+
+  def __init__(self, embedder: AbstractEmbedder, cache_dir: str, embedder_id: str, max_size_bytes=8 * 2 ** 30,
+               dtype=np.float32):
+    self.embedder = embedder
+    self.cache_dir = cache_dir
+    self.embedder_id = embedder_id
+    self.max_size_bytes = max_size_bytes
+    self.dtype = dtype
+
+    os.makedirs(cache_dir, exist_ok=True)
+    self._lock = threading.Lock()  # guards _size_bytes, overwrites and eviction
+    # file mtimes order the LRU; they can tie on filesystems with coarse timestamps,
+    # so files used by this process are also ordered by this counter
+    self._accesses = itertools.count()
+    self._last_access = {}
+    self._size_bytes = sum([os.path.getsize(f) for f in self._cached_files()])
+
+  def _cached_files(self):
+    return [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.npy')]
+
+  def _path(self, tokens) -> str:
+    key = json.dumps([self.embedder_id, [str(t) for t in tokens]], ensure_ascii=False)
+    return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npy')
+
+  def _touch(self, path):
+    os.utime(path)  # LRU: mark as recently used
+    self._last_access[path] = next(self._accesses)
+
+  def _load(self, path):
+    try:
+      embedding = np.load(path, mmap_mode='r')
+      self._touch(path)
+      return embedding
+    except (IOError, ValueError):
+      return None
+
+  def _store(self, path, embedding):
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.save(f, np.asarray(embedding, dtype=self.dtype))
+    size = os.path.getsize(tmp_path)
+
+    with self._lock:
+      try:
+        size -= os.path.getsize(path)  # another thread has just stored the same sentence
+      except OSError:
+        pass
+      os.replace(tmp_path, path)
+      self._touch(path)
+
+      self._size_bytes += size
+      if self._size_bytes > self.max_size_bytes:
+        self._evict()
+
+  def _evict(self):
+    files = sorted(self._cached_files(), key=lambda f: (os.path.getmtime(f), self._last_access.get(f, -1)))
+    self._size_bytes = sum([os.path.getsize(f) for f in files])
+
+    for f in files:
+      if self._size_bytes <= self.max_size_bytes:
+        break
+      try:
+        size = os.path.getsize(f)
+        os.remove(f)
+        self._size_bytes -= size
+      except OSError:
+        pass  # removed by another process
+      self._last_access.pop(f, None)
+
+  def get_embedding_tensor(self, tokenized_sentences_list):
+    return self.embedder.get_embedding_tensor(tokenized_sentences_list)
+
+  def get_embedder_id(self) -> str:
+    return self.embedder_id
+
+  def embedd_tokenized_text(self, words, lens):
+    paths = [self._path(words[i][0:lens[i]]) for i in range(len(lens))]
+    sentences_emb = [self._load(path) for path in paths]
+
+    misses = [i for i in range(len(lens)) if sentences_emb[i] is None]
+    if len(misses) > 0:
+      maxlen = max([lens[i] for i in misses])
+      _strings = np.array([list(words[i][0:lens[i]]) + [' '] * (maxlen - lens[i]) for i in misses])
+
+      ## ======== call TENSORFLOW -----==================
+      embeddings, _ = self.embedder.embedd_tokenized_text(_strings, [lens[i] for i in misses])
+      ## ================================================
+
+      for j, i in enumerate(misses):
+        # what is stored: a miss gives the same values as the hits of the next runs
+        sentences_emb[i] = np.asarray(embeddings[j][0:lens[i]], dtype=self.dtype)
+        self._store(paths[i], sentences_emb[i])
+
+    if len(lens) == 1 and len(misses) == 0:
+      # zero-copy, memory-mapped
+      return sentences_emb[0][np.newaxis], words
+
+    maxlen = max([len(s) for s in words])
+    out = np.zeros((len(lens), maxlen, sentences_emb[0].shape[-1]), dtype=np.result_type(*sentences_emb))
+    for i in range(len(lens)):
+      out[i, 0:lens[i]] = sentences_emb[i]
+
+    return out, words
+
+
 class ElmoEmbedder(AbstractEmbedder):
 
-  def __init__(self, elmo, tf, layer_name, create_module_method):
+  def __init__(self, elmo, tf, layer_name, create_module_method, persistent_graph=False, model_id: str = None):
+    """
+    :param persistent_graph: build the ELMo graph once (with placeholders for tokens and lengths) and only feed
+    data afterwards; the graph does not grow from call to call, so no periodic reset() is needed
+    :param model_id: the module URL or path, identifies the model in embedding caches (see get_embedder_id);
+    pattern embeddings are not cached without it
+    """
+    self.model_id = model_id
     self.create_module_method = create_module_method
     self.elmo = elmo
     self.config = tf.ConfigProto()
@@ -117,10 +269,61 @@ class ElmoEmbedder(AbstractEmbedder):
 
     self.sessionruns = 0
 
+    self.persistent_graph = persistent_graph
+    self._tokens_graph = None
+    self._default_graph = None
+
+    # graph building and reset() are not thread-safe; the pipeline stages (see parsing.run_pipeline)
+    # may call the embedder from different threads
+    self._lock = threading.RLock()
+
+  def get_embedder_id(self) -> str:
+    if self.model_id is None:
+      return None
+    return f'{type(self).__name__}:{self.model_id}:{self.layer_name}'
+
+  def _get_tokens_graph(self):
+    if self._tokens_graph is None:
+      tokens = self.tf.placeholder(dtype=self.tf.string, shape=[None, None], name='elmo_tokens')
+      lens = self.tf.placeholder(dtype=self.tf.int32, shape=[None], name='elmo_sequence_len')
+
+      embeddings = self.elmo(
+        inputs={
+          "tokens": tokens,
+          "sequence_len": lens
+        },
+        signature="tokens",
+        as_dict=True)[self.layer_name]
+
+      self.session.run(self.tf.global_variables_initializer())
+      self._tokens_graph = (tokens, lens, embeddings)
+
+    return self._tokens_graph
+
+  def _get_default_graph(self):
+    if self._default_graph is None:
+      strings = self.tf.placeholder(dtype=self.tf.string, shape=[None], name='elmo_strings')
+      embeddings = self.elmo(strings, signature="default", as_dict=True)[self.layer_name]
+
+      self.session.run(self.tf.global_variables_initializer())
+      self._default_graph = (strings, embeddings)
+
+    return self._default_graph
+
   def embedd_tokenized_text(self, words, lens):
+    with self._lock:
+      return self._embedd_tokenized_text(words, lens)
+
+  def _embedd_tokenized_text(self, words, lens):
     # with self.tf.Session(config=self.config) as sess:
     print(f'🐌 Embedding { np.nansum(lens) } words... it takes time (☕️?)..')
 
+    if self.persistent_graph:
+      tokens_ph, lens_ph, embeddings = self._get_tokens_graph()
+      out = self.session.run(embeddings, feed_dict={tokens_ph: words, lens_ph: lens})
+      print(f'Embedding complete 🐌 ; the shape is { out.shape }')
+      return out, words
+
     embeddings = self.elmo(
       inputs={
         "tokens": words,
@@ -138,6 +341,14 @@ class ElmoEmbedder(AbstractEmbedder):
 
 
   def get_embedding_tensor(self, str, signature="default"):
+    with self._lock:
+      return self._get_embedding_tensor(str, signature)
+
+  def _get_embedding_tensor(self, str, signature="default"):
+    if self.persistent_graph and signature == "default":
+      strings_ph, embedding_tensor = self._get_default_graph()
+      return np.array(self.session.run(embedding_tensor, feed_dict={strings_ph: str}))
+
     embedding_tensor = self.elmo(str, signature=signature, as_dict=True)[self.layer_name]
 
     # with self.tf.Session(config=self.config) as sess:
@@ -166,6 +377,8 @@ class ElmoEmbedder(AbstractEmbedder):
     del self.session
     self.elmo = None
     self.session = None
+    self._tokens_graph = None
+    self._default_graph = None
 
     print(gc.collect())
     gc.enable()
@@ -5,12 +5,15 @@
 
 # legal_docs.py
 
+import os
+import tempfile
 from functools import wraps
 
 from doc_structure import DocumentStructure, StructureLine
-from embedding_tools import embedd_tokenized_sentences_list
+from embedding_tools import embedd_tokenized_sentences_list, embedd_tokenized_sentences_bucketed, BATCH_TOKENS_BUDGET
 from ml_tools import normalize, smooth, extremums, smooth_safe, remove_similar_indexes, ProbableValue, \
-  max_exclusive_pattern, TokensWithAttention
+  max_exclusive_pattern, TokensWithAttention, DistancesPerPattern, sum_and_count_nonzero_by_segments, \
+  PrecisionPolicy, DEFAULT_PRECISION
 from parsing import profile, print_prof_data, ParsingSimpleContext
 from patterns import *
 from patterns import AV_SOFT, AV_PREFIX, PatternSearchResult, PatternSearchResults
@@ -23,6 +26,9 @@ from transaction_values import extract_sum_from_tokens, split_by_number_2, extra
 
 REPORTED_DEPRECATED = {}
 
+# documents this long are embedded into a np.memmap file when LegalDocument.embeddings_memmap_dir is set
+MEMMAP_MIN_TOKENS = 100000
+
 import gc
 
 from ml_tools import put_if_better
@@ -75,6 +81,10 @@ def deprecated(fn):
 
 
 class LegalDocument(EmbeddableText):
+  # dtypes of embeddings and attention vectors; set on the class to change them for all documents
+  precision: PrecisionPolicy = DEFAULT_PRECISION
+  # where to put the np.memmap files of the embeddings of documents over MEMMAP_MIN_TOKENS; None: keep them in memory
+  embeddings_memmap_dir: str = None
 
   def __init__(self, original_text=None, name="legal_doc"):
     super().__init__()
@@ -84,7 +94,10 @@ class LegalDocument(EmbeddableText):
     self.tokens_cc = None
     self.embeddings = None
     self.normal_text = None
-    self.distances_per_pattern_dict = {}
+    self.distances_per_pattern_dict = DistancesPerPattern(dtype=self.precision.distances)
+    self._newlines = None
+    self._newlines_tokens = None
+    self._newlines_size = 0
 
     self.sections = None
     self.name = name
@@ -108,7 +121,7 @@ class LegalDocument(EmbeddableText):
     return self.tokens
 
   def preprocess_text(self, text):
-    return normalize_text(text, replacements_regex)
+    return normalize_text(text, fused_replacements_regex)
 
   def __del__(self):
     print(f"----------------- LegalDocument {self.name} deleted. Ciao bella!")
@@ -212,7 +225,7 @@ class LegalDocument(EmbeddableText):
     sentences_emb, wrds, lens = embedd_tokenized_sentences_list(factory.embedder, tokenized_sentences_list)
 
     for i in range(len(headline_indexes)):
-      embedded_headlines[i].embeddings = sentences_emb[i][0:lens[i]]
+      embedded_headlines[i].embeddings = self.precision.store_embeddings(sentences_emb[i][0:lens[i]])
       embedded_headlines[i].calculate_distances_per_pattern(factory)
 
     return embedded_headlines
@@ -283,16 +296,32 @@ class LegalDocument(EmbeddableText):
   def find_sum_in_section(self):
     raise Exception('not implemented')
 
+  def get_newlines(self) -> np.ndarray:
+    """
+    indexes of '\n' tokens; built on first use and kept until self.tokens is replaced
+    """
+    tokens = self.tokens
+    if self._newlines_tokens is not tokens or self._newlines_size != len(tokens):
+      self._newlines = find_newlines(tokens)
+      self._newlines_tokens = tokens
+      self._newlines_size = len(tokens)
+    return self._newlines
+
+  newlines = property(get_newlines)
+
   def find_sentence_beginnings(self, best_indexes):
-    return [find_token_before_index(self.tokens, i, '\n', 0) for i in best_indexes]
+    # the '\n' before each index, 0 if there is none
+    newlines = np.concatenate(([0], self.newlines))
+    return newlines[np.searchsorted(self.newlines, best_indexes)].tolist()
 
   @profile
   def calculate_distances_per_pattern(self, pattern_factory: AbstractPatternFactory, dist_function=DIST_FUNC,
-                                      verbosity=1, merge=False, pattern_prefix=None):
+                                      verbosity=1, merge=False, pattern_prefix=None, batched=True):
     assert self.embeddings is not None
     self.distances_per_pattern_dict = calculate_distances_per_pattern(self, pattern_factory, dist_function, merge=merge,
                                                                       verbosity=verbosity,
-                                                                      pattern_prefix=pattern_prefix)
+                                                                      pattern_prefix=pattern_prefix,
+                                                                      batched=batched)
 
     return self.distances_per_pattern_dict
 
@@ -306,12 +335,15 @@ class LegalDocument(EmbeddableText):
     sub = klazz("REF")
     sub.start = _s.start
     sub.end = _s.stop
+    sub.precision = self.precision
 
     if self.embeddings is not None:
       sub.embeddings = self.embeddings[_s]
 
-    if self.distances_per_pattern_dict is not None:
-      sub.distances_per_pattern_dict = {}
+    if isinstance(self.distances_per_pattern_dict, DistancesPerPattern):
+      sub.distances_per_pattern_dict = self.distances_per_pattern_dict.slice(_s)
+    elif self.distances_per_pattern_dict is not None:
+      sub.distances_per_pattern_dict = DistancesPerPattern(dtype=self.precision.distances)
       for d in self.distances_per_pattern_dict:
         sub.distances_per_pattern_dict[d] = self.distances_per_pattern_dict[d][_s]
 
@@ -332,7 +364,7 @@ class LegalDocument(EmbeddableText):
         :param text:
         :return:
         """
-    sents = ru_tokenizer.tokenize(text)
+    sents = get_ru_tokenizer().tokenize(text)
     for s in sents:
       s.replace('\n', ' ')
 
@@ -351,7 +383,8 @@ class LegalDocument(EmbeddableText):
 
     for v in vectors:
       if max(v) > 0.6:
-        vector_i, _ = improve_attention_vector(self.embeddings, v, relu_th=0.6, mix=0.9)
+        vector_i, _ = improve_attention_vector(self.embeddings, v, relu_th=0.6, mix=0.9,
+                                               dtype=self.precision.distances)
         vectors_i.append(vector_i)
       else:
         vectors_i.append(v)
@@ -375,29 +408,21 @@ class LegalDocument(EmbeddableText):
 
     results: PatternSearchResults = []
 
-    for i in np.nonzero(attention)[0]:
-      _slice = get_sentence_slices_at_index(i, self.tokens)
+    # every sentence at once, instead of once per nonzero token in it
+    starts, ends = get_sentence_slices(self.tokens, self.newlines)
+    sums, nonzeros_counts = sum_and_count_nonzero_by_segments(attention, starts, ends)
 
-      if _slice.stop != _slice.start:
+    for k in np.nonzero(nonzeros_counts)[0]:
+      confidence = sums[k] / nonzeros_counts[k]
 
-        sum_ = sum(attention[_slice])
-        #       confidence = np.mean( np.nonzero(x[sl]) )
-        nonzeros_count = len(np.nonzero(attention[_slice])[0])
-        confidence = 0
+      if confidence > 0.8:
+        r = PatternSearchResult(ORG_2_ORG[org_level], slice(int(starts[k]), int(ends[k])))
+        r.attention_vector_name = attention_vector_name
+        r.pattern_prefix = pattern_prefix
+        r.confidence = confidence
+        r.parent = self
 
-        if nonzeros_count > 0:
-          confidence = sum_ / nonzeros_count
-
-        if confidence > 0.8:
-          r = PatternSearchResult(ORG_2_ORG[org_level], _slice)
-          r.attention_vector_name = attention_vector_name
-          r.pattern_prefix = pattern_prefix
-          r.confidence = confidence
-          r.parent = self
-
-          results.append(r)
-
-    results = remove_sr_duplicates_conditionally(results)
+        results.append(r)
 
     return results
 
@@ -439,9 +464,10 @@ class LegalDocument(EmbeddableText):
   def embedd(self, pattern_factory):
     max_tokens = 6000
     if len(self.tokens) > max_tokens:
-      self._embedd_large(pattern_factory.embedder, max_tokens)
+      memmap_dir = self.embeddings_memmap_dir if len(self.tokens) >= MEMMAP_MIN_TOKENS else None
+      self._embedd_large(pattern_factory.embedder, max_tokens, memmap_dir=memmap_dir)
     else:
-      self.embeddings = self._emb(self.tokens, pattern_factory.embedder)
+      self.embeddings = self.precision.store_embeddings(self._emb(self.tokens, pattern_factory.embedder))
 
     print_prof_data()
 
@@ -451,43 +477,79 @@ class LegalDocument(EmbeddableText):
     embeddings = embeddings[0]
     return embeddings
 
-  @profile
-  def _embedd_large(self, embedder, max_tokens=6000):
+  def _allocate_embeddings(self, shape, memmap_dir=None) -> np.ndarray:
+    """
+    :param memmap_dir: when given, the array is a np.memmap of a file created in this directory;
+    the file is unlinked right away (where the OS allows), so it goes when the last view of it does
+    """
+    if memmap_dir is None:
+      return np.zeros(shape, dtype=self.precision.embeddings)
+
+    fd, path = tempfile.mkstemp(prefix=f'{self.name}.', suffix='.embeddings', dir=memmap_dir)
+    os.close(fd)
+    embeddings = np.memmap(path, dtype=self.precision.embeddings, mode='w+', shape=shape)
+    try:
+      os.unlink(path)
+    except OSError:
+      pass  # Windows: an open file can not be removed
+
+    return embeddings
 
+  def get_embedding_windows(self, max_tokens=6000) -> List[slice]:
+    """
+    :return: token ranges to embed one by one: a window every max_tokens tokens, with 20% more tokens
+    of the right context (only the first max_tokens of each are kept); a document of up to max_tokens is one window
+    """
     overlap = int(max_tokens / 5)  # 20%
+    n = len(self.tokens)
+    return [slice(start, min(start + max_tokens + overlap, n)) for start in range(0, n, max_tokens)]
+
+  @profile
+  def _embedd_large(self, embedder, max_tokens=6000, max_batch_windows=4, memmap_dir=None):
+    """
+    Embeds the document in windows of max_tokens; every window gets 20% more tokens of the right context,
+    the embeddings of those are dropped. Windows go to the embedder in padded batches of up to max_batch_windows,
+    and the non-overlapping part of each window is written right into one preallocated document-sized array.
+
+    :param memmap_dir: back the array with a np.memmap file in this directory (see _allocate_embeddings);
+    batches are written to it as they come, so only one batch of embeddings is in memory at a time
+    """
 
-    number_of_windows = 1 + int(len(self.tokens) / max_tokens)
+    overlap = int(max_tokens / 5)  # 20%
     window = max_tokens
 
+    windows = self.get_embedding_windows(max_tokens)
+    starts = [w.start for w in windows]
+
     print(
       "WARNING: Document is too large for embedding: {} tokens. Splitting into {} windows overlapping with {} tokens ".format(
-        len(self.tokens), number_of_windows, overlap))
-    start = 0
+        len(self.tokens), len(starts), overlap))
+
     embeddings = None
-    tokens = []
-    while start < len(self.tokens):
-      #             start_time = time.time()
-      subtokens = self.tokens[start:start + window + overlap]
-      print("Embedding region:", start, len(subtokens))
+    for b in range(0, len(starts), max_batch_windows):
+      batch_starts = starts[b:b + max_batch_windows]
 
-      sub_embeddings = self._emb(subtokens, embedder)
+      subtokens_list = [self.tokens[w] for w in windows[b:b + max_batch_windows]]
+      lens = [len(subtokens) for subtokens in subtokens_list]
+      maxlen = max(lens)
+      _strings = np.array([list(subtokens) + [' '] * (maxlen - len(subtokens)) for subtokens in subtokens_list])
 
-      sub_embeddings = sub_embeddings[0:window]
-      subtokens = subtokens[0:window]
+      print("Embedding regions:", batch_starts, lens)
+      sub_embeddings, _ = embedder.embedd_tokenized_text(_strings, lens)
 
       if embeddings is None:
-        embeddings = sub_embeddings
-      else:
-        embeddings = np.concatenate([embeddings, sub_embeddings])
-      tokens += subtokens
+        embeddings = self._allocate_embeddings((len(self.tokens), sub_embeddings.shape[-1]), memmap_dir)
 
-      start += window
-      #             elapsed_time = time.time() - start_time
-      #             print ("Elapsed time %d".format(t))
-      print_prof_data()
+      for i in range(len(batch_starts)):
+        start = batch_starts[i]
+        stop = min(start + window, len(self.tokens))
+        embeddings[start:stop] = sub_embeddings[i][0:stop - start]
+
+      del sub_embeddings
+      if isinstance(embeddings, np.memmap):
+        embeddings.flush()
 
     self.embeddings = embeddings
-    self.tokens = tokens
 
 
 class ContractDocument(LegalDocument):
@@ -733,7 +795,7 @@ def extract_sum_from_doc(doc: LegalDocument, attention_mask=None, relu_th=0.5):
 
 def _extract_sum_from_distances____(doc: LegalDocument, sums_no_padding):
   max_i = np.argmax(sums_no_padding)
-  start, end = get_sentence_bounds_at_index(max_i, doc.tokens)
+  start, end = get_sentence_bounds_at_index(max_i, doc.tokens, doc.newlines)
   sentence_tokens = doc.tokens[start + 1:end]
 
   f, sentence = extract_sum_from_tokens(sentence_tokens)
@@ -746,7 +808,7 @@ def _extract_sums_from_distances(doc: LegalDocument, x):
 
   results = []
   for max_i in maximas:
-    start, end = get_sentence_bounds_at_index(max_i, doc.tokens)
+    start, end = get_sentence_bounds_at_index(max_i, doc.tokens, doc.newlines)
     sentence_tokens = doc.tokens[start + 1:end]
 
     f, sentence = extract_sum_from_tokens(sentence_tokens)
@@ -783,7 +845,7 @@ def make_soft_attention_vector(doc, pattern_prefix, relu_th=0.5, blur=60, norm=T
   try:
     if norm:
       attention_vector = normalize(attention_vector)
-  except:
+  except Exception:
     print(
       "----ERROR: make_soft_attention_vector: attention_vector for pattern prefix {} is not contrast, len = {}".format(
         pattern_prefix, len(attention_vector)))
@@ -810,7 +872,7 @@ def soft_attention_vector(doc, pattern_prefix, relu_th=0.5, blur=60, norm=True):
   try:
     if norm:
       attention_vector = normalize(attention_vector)
-  except:
+  except Exception:
     print("----ERROR: soft_attention_vector: attention_vector for pattern prefix {} is not contrast, len = {}".format(
       pattern_prefix, len(attention_vector)))
 
@@ -825,8 +887,9 @@ def _find_sentences_by_attention_vector(doc, _attention_vector, relu_th=0.5):
   maxes = remove_similar_indexes(maxes, 6)
 
   res = {}
+  newlines = doc.newlines
   for i in maxes:
-    s, e = get_sentence_bounds_at_index(i + 1, doc.tokens)
+    s, e = get_sentence_bounds_at_index(i + 1, doc.tokens, newlines)
     if e - s > 0:
       res[s] = e
 
@@ -923,7 +986,7 @@ def embedd_generic_tokenized_sentences(strings: List[str], factory: AbstractPatt
 
     embedded_docs[i].tokens = tokens
     embedded_docs[i].tokens_cc = tokens
-    embedded_docs[i].embeddings = line_emb
+    embedded_docs[i].embeddings = embedded_docs[i].precision.store_embeddings(line_emb)
     embedded_docs[i].calculate_distances_per_pattern(factory)
 
   return embedded_docs
@@ -959,11 +1022,42 @@ def embedd_generic_tokenized_sentences_2(strings: List[str], embedder) -> \
 
     embedded_docs[i].tokens = tokens
     embedded_docs[i].tokens_cc = tokens
-    embedded_docs[i].embeddings = line_emb
+    embedded_docs[i].embeddings = embedded_docs[i].precision.store_embeddings(line_emb)
 
   return embedded_docs
 
 
+def embedd_documents(docs: List[LegalDocument], embedder, max_tokens=6000, max_batch_tokens=BATCH_TOKENS_BUDGET):
+  """
+  LegalDocument.embedd for many parsed documents at once: the embedding windows of all of them
+  (see get_embedding_windows) go to the embedder together, in length buckets of up to max_batch_tokens
+  (see embedd_tokenized_sentences_bucketed), instead of one or a few embedder calls per document.
+  Every window is embedded on its own, so the embeddings are those LegalDocument.embedd makes.
+
+  Documents to be memory-mapped (see LegalDocument.embeddings_memmap_dir) are embedded one by one,
+  so that the whole of them is never in memory.
+  """
+  windows = []  # (doc, window)
+  for doc in docs:
+    if doc.embeddings_memmap_dir is not None and len(doc.tokens) >= MEMMAP_MIN_TOKENS:
+      doc._embedd_large(embedder, max_tokens, memmap_dir=doc.embeddings_memmap_dir)
+    else:
+      windows += [(doc, w) for w in doc.get_embedding_windows(max_tokens)]
+
+  if len(windows) == 0:
+    return
+
+  sentences_emb, _, _ = embedd_tokenized_sentences_bucketed(embedder, [doc.tokens[w] for doc, w in windows],
+                                                            max_batch_tokens)
+
+  for (doc, w), emb in zip(windows, sentences_emb):
+    if w.start == 0:
+      doc.embeddings = doc._allocate_embeddings((len(doc.tokens), emb.shape[-1]))
+
+    stop = min(w.start + max_tokens, len(doc.tokens))
+    doc.embeddings[w.start:stop] = emb[0:stop - w.start]
+
+
 def subdoc_between_lines(line_a: int, line_b: int, doc):
   _str = doc.structure.structure
   start = _str[line_a].span[1]
@@ -984,19 +1078,34 @@ org_types = {
 
 def calculate_distances_per_pattern(doc: LegalDocument, pattern_factory: AbstractPatternFactory,
                                     dist_function=DIST_FUNC, merge=False,
-                                    pattern_prefix=None, verbosity=1):
-  distances_per_pattern_dict = {}
+                                    pattern_prefix=None, verbosity=1, batched=True):
+  """
+  :param batched: match all patterns of the same window length at once (one pass over the document
+  per window length) instead of one pass per pattern
+  """
+  distances_per_pattern_dict = DistancesPerPattern(dtype=doc.precision.distances)
   if merge:
     distances_per_pattern_dict = doc.distances_per_pattern_dict
 
-  c = 0
+  patterns = []
   for pat in pattern_factory.patterns:
     if pattern_prefix is None or pat.name[:len(pattern_prefix)] == pattern_prefix:
       if verbosity > 1: print(f'estimating distances to pattern {pat.name}', pat)
+      patterns.append(pat)
+
+  dtype = doc.precision.distances
+  # normalized once for all the patterns, dropped when done
+  text_norm = normalize_text_rows(doc.embeddings) if dist_function in TEXT_NORM_DIST_FUNCTIONS else None
+  if batched:
+    vectors = make_patterns_attention_vectors(patterns, doc.embeddings, dist_function, dtype=dtype, text_norm=text_norm)
+  else:
+    vectors = [make_pattern_attention_vector(pat, doc.embeddings, dist_function, dtype=dtype, text_norm=text_norm)
+               for pat in patterns]
+
+  for pat, dists in zip(patterns, vectors):
+    distances_per_pattern_dict[pat.name] = dists
 
-      dists = make_pattern_attention_vector(pat, doc.embeddings, dist_function)
-      distances_per_pattern_dict[pat.name] = dists
-      c += 1
+  c = len(patterns)
 
   # if verbosity > 0:
   #   print(distances_per_pattern_dict.keys())
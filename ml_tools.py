@@ -1,3 +1,5 @@
+from collections.abc import MutableMapping
+from functools import lru_cache
 from typing import List
 
 import numpy as np
@@ -97,27 +99,83 @@ def smooth(x, window_len=11, window='hanning'):
   if x.ndim != 1:
     raise ValueError("smooth only accepts 1 dimension arrays.")
 
-  if x.size < window_len:
+  return smooth_rows(x, window_len, window)
+
+
+_SMOOTHING_WINDOWS = {
+  'flat': lambda window_len: np.ones(window_len, 'd'),  # moving average
+  'hanning': np.hanning,
+  'hamming': np.hamming,
+  'bartlett': np.bartlett,
+  'blackman': np.blackman
+}
+
+# np.convolve wins below this window length at any document size, FFT above it
+FFT_SMOOTH_MIN_WINDOW = 256
+
+
+@lru_cache(maxsize=256)
+def get_smoothing_window(window, window_len):
+  """
+  :return: read-only window of the given kind and length, scaled to sum up to 1
+  """
+  if window not in _SMOOTHING_WINDOWS:
+    raise ValueError("Window is on of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'")
+
+  w = _SMOOTHING_WINDOWS[window](window_len)
+  w = w / w.sum()
+  w.flags.writeable = False
+  return w
+
+
+def _convolve_valid_fft(w, s):
+  n = s.shape[-1]
+  nfft = 1 << (n + len(w) - 2).bit_length()
+  y = np.fft.irfft(np.fft.rfft(s, nfft) * np.fft.rfft(w, nfft), nfft)[..., len(w) - 1:n]
+
+  # Where the exact convolution is zero (long zero runs of relu-ed attention vectors), the transform leaves
+  # round-off noise of either sign instead (~1e-16 x max|s|). Only values within the round-off bound of the
+  # transform are snapped to zero: np.convolve keeps those zeros exact, and callers test attention vectors
+  # for == 0 and > 0; a tiny negative value would also turn up in a non-negative signal.
+  roundoff = 8 * np.finfo(y.dtype).eps * np.log2(nfft) * np.sum(np.abs(w)) * np.max(np.abs(s), axis=-1, keepdims=True)
+  y[np.abs(y) <= roundoff] = 0
+  return y
+
+
+def _convolve_valid(w, s):
+  if len(w) >= FFT_SMOOTH_MIN_WINDOW and np.isfinite(s).all():
+    return _convolve_valid_fft(w, s)
+
+  if s.ndim == 1:
+    return np.convolve(w, s, mode='valid')
+
+  return np.array([np.convolve(w, row, mode='valid') for row in s]).reshape(len(s), -1)
+
+
+def smooth_rows(x, window_len=11, window='hanning'):
+  """
+  smooth: for every row of a 2-D array (or for a vector). Windows of FFT_SMOOTH_MIN_WINDOW and longer
+  are convolved with one FFT call for all the rows; shorter ones row by row with np.convolve, which is faster there
+  :param x: 1-D signal or 2-D array of signals of the same length, one per row
+  :return: smoothed signal(s) of the same shape
+  """
+  x = np.asarray(x)
+  if x.ndim not in (1, 2):
+    raise ValueError("smooth_rows only accepts 1 or 2 dimension arrays.")
+
+  if x.shape[-1] < window_len:
     raise ValueError("Input vector needs to be bigger than window size.")
 
   if window_len < 3:
     return x
 
-  if not window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
-    raise ValueError("Window is on of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'")
+  w = get_smoothing_window(window, window_len)
 
-  s = np.r_[x[window_len - 1:0:-1], x, x[-2:-window_len - 1:-1]]
-  # print(len(s))
-  if window == 'flat':  # moving average
-    w = np.ones(window_len, 'd')
-  else:
-    w = eval('np.' + window + '(window_len)')
+  s = np.concatenate([x[..., window_len - 1:0:-1], x, x[..., -2:-window_len - 1:-1]], axis=-1)
+  y = _convolve_valid(w, s)
 
-  y = np.convolve(w / w.sum(), s, mode='valid')
-  #     return y
   halflen = int(window_len / 2)
-  #     return y[0:len(x)]
-  return y[(halflen - 1):-halflen]
+  return y[..., (halflen - 1):-halflen]
 
 
 def relu(x, relu_th: float = 0.0):
@@ -128,6 +186,18 @@ def relu(x, relu_th: float = 0.0):
 
 
 def extremums(x):
+  """
+  :return: 0 and the indexes of strict local maxima
+  """
+  x = np.asarray(x)
+  if len(x) < 3:
+    return [0]
+
+  maxima = (x[1:-1] > x[:-2]) & (x[1:-1] > x[2:])
+  return [0] + (np.nonzero(maxima)[0] + 1).tolist()
+
+
+def _extremums_loop(x):
   extremums = [0]
   for i in range(1, len(x) - 1):
     if x[i - 1] < x[i] > x[i + 1]:
@@ -142,6 +212,16 @@ def softmax(v):
 
 
 def make_echo(av, k=0.5):
+  """
+  every value is the last one above k so far, 0 before the first one
+  """
+  av = np.asarray(av, dtype=float)
+  above = np.where(av > k, np.arange(len(av)), -1)
+  last_above = np.maximum.accumulate(above) if len(av) else above
+  return np.where(last_above >= 0, av[last_above], 0.0)
+
+
+def _make_echo_loop(av, k=0.5):
   innertia = np.zeros(len(av))
   sum = 0
 
@@ -174,7 +254,63 @@ def make_echo(av, k=0.5):
 #     m[i] = max(av[i], m[i-1]*decay)
 #   return m
 
+def _decayed_accumulate(x, decay, accumulate):
+  """
+  y[i] = accumulate(y[i-1] * decay, x[i]), y[-1] = 0, computed as
+  decay^i * accumulate(x[j] / decay^j) in blocks short enough for decay^-block to stay far from overflow
+  :param accumulate: np.fmax (running maximum, nan ignored) or np.add (running sum)
+  """
+  x = np.asarray(x, dtype=float)
+  y = np.empty(len(x))
+
+  log_decay = abs(np.log(decay))
+  block = max(1, len(x) if log_decay == 0 else int(300 / log_decay))
+
+  carry = 0.0
+  for start in range(0, len(x), block):
+    chunk = x[start:start + block]
+    powers = decay ** np.arange(len(chunk), dtype=float)
+
+    scaled = chunk / powers
+    acc = accumulate(accumulate.accumulate(scaled), carry * decay)
+    y_chunk = acc * powers
+    if accumulate is np.fmax:
+      # where the current value is the maximum, take it as is, not rescaled
+      current = scaled >= acc
+      y_chunk[current] = chunk[current]
+
+    y[start:start + len(chunk)] = y_chunk
+    carry = y_chunk[-1]
+
+  return y
+
+
 def momentum_(x, decay=0.99):
+  """
+  m[i] = m[i-1] * decay + x[i]
+  """
+  if decay <= 0:
+    return _momentum__loop(x, decay)
+  return _decayed_accumulate(x, decay, np.add)
+
+
+def momentum(x, decay=0.999):
+  """
+  m[i] = max(m[i-1] * decay, x[i]), starting from 0
+  """
+  if decay <= 0:
+    return _momentum_loop(x, decay)
+  return _decayed_accumulate(x, decay, np.fmax)
+
+
+def momentum_reversed(x, decay=0.999):
+  """
+  momentum, running from the end
+  """
+  return momentum(np.asarray(x)[::-1], decay)[::-1]
+
+
+def _momentum__loop(x, decay=0.99):
   innertia = np.zeros(len(x))
   m = 0
   for i in range(len(x)):
@@ -185,7 +321,7 @@ def momentum_(x, decay=0.99):
   return innertia
 
 
-def momentum(x, decay=0.999):
+def _momentum_loop(x, decay=0.999):
   innertia = np.zeros(len(x))
   m = 0
   for i in range(len(x)):
@@ -196,7 +332,7 @@ def momentum(x, decay=0.999):
   return innertia
 
 
-def momentum_reversed(x, decay=0.999):
+def _momentum_reversed_loop(x, decay=0.999):
   innertia = np.zeros(len(x))
   m = 0
   for i in reversed(range(0, len(x))):
@@ -217,15 +353,11 @@ def onehot_column(a, mask=-2 ** 32, replacement=None):
   :param mask:
   :return:
   """
-  maximals = np.max(a, 0)
+  losers = a < np.max(a, 0)
 
-  for i in range(a.shape[0]):
-    for j in range(a.shape[1]):
-      if a[i, j] < maximals[j]:
-        a[i, j] = mask
-      else:
-        if replacement is not None:
-          a[i, j] = replacement
+  if replacement is not None:
+    a[~losers] = replacement
+  a[losers] = mask
 
   return a
 
@@ -256,6 +388,32 @@ def cut_above(x: np.ndarray, threshold: float) -> List[float]:
   return threshold + relu(float___threshold) * -1.0
 
 
+def sum_and_count_nonzero_by_segments(x, starts, ends):
+  """
+  per-segment sum and count of nonzero values of x, in one np.add.reduceat pass
+  :param starts: segment starts
+  :param ends: segment ends (exclusive); empty or reversed segments give zeros
+  :return: sums, counts
+  """
+  x = np.asarray(x)
+  starts = np.asarray(starts, dtype=int)
+  ends = np.asarray(ends, dtype=int)
+  if len(starts) == 0:
+    return np.zeros(0, dtype=x.dtype), np.zeros(0, dtype=int)
+
+  # a trailing zero makes len(x) a valid segment bound
+  padded = np.append(x, 0)
+  # odd positions are the gaps between segments
+  bounds = np.column_stack([np.minimum(starts, len(x)), np.minimum(ends, len(x))]).ravel()
+
+  empty = ends <= starts
+  sums = np.add.reduceat(padded, bounds)[0::2]
+  counts = np.add.reduceat((padded != 0).astype(int), bounds)[0::2]
+  sums[empty] = 0
+  counts[empty] = 0
+  return sums, counts
+
+
 def put_if_better(destination: dict, key, x, is_better: staticmethod):
   if key in destination:
     if is_better(x, destination[key]):
@@ -277,7 +435,162 @@ def rectifyed_sum(vectors, relu_th: float = 0.0):
   return sum
 
 
+class PrecisionPolicy:
+  """
+  dtypes of the per-token numbers of a document:
+
+    embeddings: what LegalDocument.embeddings are stored as; float16 halves the memory of a document
+    distances: what attention (distance) vectors are stored and returned as
+
+  Computation is float32 whatever the storage is: the distance kernels cast embeddings block by block
+  (cumulative sums are float64), numpy has no fast float16 arithmetic.
+  """
+
+  def __init__(self, embeddings=np.float32, distances=np.float32):
+    self.embeddings = np.dtype(embeddings)
+    self.distances = np.dtype(distances)
+
+  def store_embeddings(self, embeddings) -> np.ndarray:
+    """
+    :return: embeddings in the storage dtype; no copy when they already are
+    """
+    return np.asarray(embeddings, dtype=self.embeddings)
+
+  def __repr__(self):
+    return f'PrecisionPolicy(embeddings={self.embeddings}, distances={self.distances})'
+
+
+PRECISION_FLOAT32 = PrecisionPolicy()
+PRECISION_FLOAT16 = PrecisionPolicy(embeddings=np.float16)
+PRECISION_FLOAT64 = PrecisionPolicy(embeddings=np.float64, distances=np.float64)  # the reference, for accuracy checks
+
+DEFAULT_PRECISION = PRECISION_FLOAT32
+
+
+class DistancesPerPattern(MutableMapping):
+  """
+  Dict-like store of per-token attention (distance) vectors, keyed by pattern name.
+
+  All vectors live in one contiguous 2-D float32 matrix (one row per name, one column per token),
+  so a subdoc gets a zero-copy column view of it, and a prefix lookup is a slice of rows.
+
+  Unlike the plain dict it replaces:
+    - stored vectors are cast to `dtype` (float32 by default);
+    - all vectors must have the same length (the number of tokens), a vector of another length raises ValueError;
+    - vectors are returned as read-only row views: `d[k] += x` and `d[k][i] = x` raise ValueError,
+      assign a new vector instead (`d[k] = d[k] + x`) or work on a copy.
+
+  Rows are shared between a store and its slices; whichever of them overwrites a row after slicing
+  copies its buffer first (copy-on-write), so they never see each other's changes.
+  """
+
+  def __init__(self, vectors: dict = None, dtype=np.float32):
+    self.dtype = dtype
+    self._matrix = None
+    self._rows = 0
+    self._index = {}  # name -> row
+    self._rows_by_prefix = {}  # prefix -> slice or array of rows
+    self._shared = False
+
+    if vectors is not None:
+      self.update(vectors)
+
+  def get_length(self):
+    if self._matrix is None:
+      return None
+    return self._matrix.shape[1]
+
+  length = property(get_length)
+
+  def __len__(self):
+    return len(self._index)
+
+  def __iter__(self):
+    return iter(self._index)
+
+  def __contains__(self, key):
+    return key in self._index
+
+  def __getitem__(self, key):
+    v = self._matrix[self._index[key]]
+    v.flags.writeable = False
+    return v
+
+  def __setitem__(self, key, value):
+    value = np.asarray(value, dtype=self.dtype)
+    if value.ndim != 1:
+      raise ValueError(f'attention vector "{key}" must be 1-D, got shape {value.shape}')
+
+    if self._matrix is None:
+      self._matrix = np.zeros((8, len(value)), dtype=self.dtype)
+
+    if len(value) != self.length:
+      raise ValueError(f'attention vector "{key}" has length {len(value)}, expected {self.length}')
+
+    if key in self._index:
+      if self._shared:
+        self._own_buffer(self._matrix.shape[0])
+      self._matrix[self._index[key]] = value
+    else:
+      # rows past self._rows are never visible to slices, so appending needs no copy
+      if self._rows == self._matrix.shape[0]:
+        self._own_buffer(max(8, 2 * self._rows))
+      self._matrix[self._rows] = value
+      self._index[key] = self._rows
+      self._rows += 1
+      self._rows_by_prefix = {}
+
+  def __delitem__(self, key):
+    # the row stays allocated, it is just not addressable anymore
+    del self._index[key]
+    self._rows_by_prefix = {}
+
+  def _own_buffer(self, capacity):
+    m = np.zeros((capacity, self.length), dtype=self.dtype)
+    m[:self._rows] = self._matrix[:self._rows]
+    self._matrix = m
+    self._shared = False
+
+  def _prefix_rows(self, prefix: str):
+    if prefix not in self._rows_by_prefix:
+      rows = np.array([row for name, row in self._index.items() if str(name).startswith(prefix)], dtype=int)
+
+      if len(rows) > 0 and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+        rows = slice(int(rows[0]), int(rows[0]) + len(rows))
+
+      self._rows_by_prefix[prefix] = rows
+
+    return self._rows_by_prefix[prefix]
+
+  def values_by_prefix(self, prefix: str) -> np.ndarray:
+    """
+    :return: read-only (number of matching names) x tokens matrix; a view when the rows are contiguous
+    """
+    if self._matrix is None:
+      return np.zeros((0, 0), dtype=self.dtype)
+
+    m = self._matrix[self._prefix_rows(prefix)]
+    m.flags.writeable = False
+    return m
+
+  def slice(self, _s: slice) -> 'DistancesPerPattern':
+    """
+    :return: a store of the same vectors cut to the `_s` token range, sharing this store's buffer
+    """
+    sub = DistancesPerPattern(dtype=self.dtype)
+    if self._matrix is not None:
+      sub._matrix = self._matrix[:self._rows, _s]
+      sub._rows = self._rows
+      sub._index = dict(self._index)
+      sub._shared = True
+      self._shared = True
+    return sub
+
+
 def filter_values_by_key_prefix(dictionary: dict, prefix: str) -> List[List[float]]:
+  if isinstance(dictionary, DistancesPerPattern):
+    return list(dictionary.values_by_prefix(prefix))
+
   vectors = []
   for p in dictionary:
     if str(p).startswith(prefix):
@@ -1,3 +1,5 @@
+import queue
+import threading
 import time
 from functools import wraps
 
@@ -76,7 +78,7 @@ def profile(fn):
 
 
 def print_prof_data():
-  for fname, data in PROF_DATA.items():
+  for fname, data in list(PROF_DATA.items()):  # may be called while another pipeline stage is profiled
     max_time = max(data[1])
     avg_time = sum(data[1]) / len(data[1])
     print("Function {} called {} times. ".format(fname, data[0]))
@@ -88,6 +90,92 @@ def clear_prof_data():
   PROF_DATA = {}
 
 
+_PIPELINE_END = object()
+
+
+class _PipelineFailure:
+  def __init__(self, exception: BaseException):
+    self.exception = exception
+
+
+def run_pipeline(items, stages, queue_size=1):
+  """
+  Runs every item through the stages, stage i + 1 getting the result of stage i, like
+  `(stages[-1](...stages[0](item)) for item in items)`, but the stages work on different items at the same time:
+  with parse, embedd and analyze stages, document N+1 is parsed while document N is embedded and document N-1
+  is analyzed. TensorFlow and numpy release the GIL, so the regex work of one document overlaps with
+  the embedding of another.
+
+  All stages but the last run in their own threads, connected by queues of at most `queue_size` items
+  (so at most that many parsed/embedded documents wait in memory). The last stage runs in the caller's thread,
+  when the generator is iterated; results come in the order of items. An exception in any stage stops the pipeline
+  and is raised here. Stages must not share unsynchronized state: one instance of each runs at a time, but
+  different stages run concurrently. In particular, an embedder called by several stages (the document by the
+  embedding stage, its headlines by the analysis stage) must be thread-safe, as ElmoEmbedder and CachingEmbedder are.
+  """
+  *background_stages, last_stage = stages
+  stop = threading.Event()
+
+  def _put(q: queue.Queue, item) -> bool:
+    while not stop.is_set():
+      try:
+        q.put(item, timeout=0.1)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def _get(q: queue.Queue):
+    while not stop.is_set():
+      try:
+        return q.get(timeout=0.1)
+      except queue.Empty:
+        pass
+    return _PIPELINE_END
+
+  def _work(stage, inbox: queue.Queue, outbox: queue.Queue):
+    try:
+      while True:
+        item = next(source, _PIPELINE_END) if inbox is None else _get(inbox)
+        if item is _PIPELINE_END or isinstance(item, _PipelineFailure):
+          _put(outbox, item)
+          return
+        if not _put(outbox, stage(item)):
+          return
+    except BaseException as e:
+      _put(outbox, _PipelineFailure(e))
+
+  source = iter(items)
+  inbox = None
+  threads = []
+  for stage in background_stages:
+    outbox = queue.Queue(maxsize=queue_size)
+    threads.append(threading.Thread(target=_work, args=(stage, inbox, outbox), daemon=True,
+                                    name=f'pipeline-{getattr(stage, "__name__", len(threads))}'))
+    inbox = outbox
+
+  if inbox is None:
+    for item in source:
+      yield last_stage(item)
+    return
+
+  for t in threads:
+    t.start()
+
+  try:
+    while True:
+      item = inbox.get()
+      if item is _PIPELINE_END:
+        return
+      if isinstance(item, _PipelineFailure):
+        raise item.exception
+      yield last_stage(item)
+  finally:
+    stop.set()
+    for t in threads:
+      t.join()
+
+
 head_types_dict = {'head.directors': 'Совет директоров',
                    'head.all': 'Общее собрание участников/акционеров',
                    'head.gen': 'Генеральный директор',
@@ -6,8 +6,6 @@ from ml_tools import relu, filter_values_by_key_prefix, rectifyed_sum
 from structures import ContractSubject
 from transaction_values import ValueConstraint
 
-load_punkt = True
-
 from text_tools import *
 
 TEXT_PADDING_SYMBOL = ' '
@@ -18,29 +16,18 @@ PATTERN_THRESHOLD = 0.75  # 0...1
 
 import numpy as np
 
-import sys
-
 WARN='\033[1;31m======== Dear Artem, ACHTUNG! 🔞 '
 
-russian_punkt_url = 'https://github.com/Mottl/ru_punkt/raw/master/nltk_data/tokenizers/punkt/PY3/russian.pickle'
-save_nltk_dir = 'nltk_data_download/tokenizers/punkt/PY3/'
-if sys.version_info[0] < 3:
-  russian_punkt_url = 'https://github.com/Mottl/ru_punkt/raw/master/nltk_data/tokenizers/punkt/russian.pickle'
-  save_nltk_dir = 'nltk_data_download/tokenizers/punkt'
-
-import urllib.request
+import hashlib
+import json
 import os
+from collections.abc import Mapping
+from contextlib import contextmanager
 
-if not os.path.exists(save_nltk_dir):
-  os.makedirs(save_nltk_dir)
-
-if load_punkt:
-  russian_punkt = urllib.request.urlopen(russian_punkt_url)
-  with open(save_nltk_dir + 'russian.pickle', 'wb') as output:
-    output.write(russian_punkt.read())
-
-  ru_tokenizer = nltk.data.load(save_nltk_dir + 'russian.pickle')
-  print(ru_tokenizer)
+try:
+  import fcntl
+except ImportError:  # not on Windows
+  fcntl = None
 
 
 class EmbeddableText:
@@ -64,7 +51,7 @@ class FuzzyPattern(EmbeddableText):
     assert pattern_embedding[0][0]
     self.embeddings = pattern_embedding
 
-  def _eval_distances(self, _text, dist_function=DIST_FUNC, whd_padding=0, wnd_mult=1):
+  def _eval_distances(self, _text, dist_function=DIST_FUNC, whd_padding=0, wnd_mult=1, text_norm=None):
     assert self.embeddings is not None
     """
       For each token in the given sentences, it calculates the semantic distance to
@@ -73,9 +60,9 @@ class FuzzyPattern(EmbeddableText):
       WARNING: may return None!
 
       TODO: tune sliding window size
-    """
 
-    _distances = np.ones(len(_text))
+      :param text_norm: normalize_text_rows(_text), for the dist functions of TEXT_NORM_DIST_FUNCTIONS
+    """
 
     _pat = self.embeddings
 
@@ -84,20 +71,30 @@ class FuzzyPattern(EmbeddableText):
     #   print('---ERROR: pattern: "{}" window:{} > len(_text):{} (padding={} mult={})'.format(self.name, window_size, len(_text), whd_padding, wnd_mult)  )
     #   return None
 
+    kernel = SLIDING_WINDOW_KERNELS.get(dist_function)
+    if kernel is not None and window_size > 0:
+      if text_norm is not None and dist_function in TEXT_NORM_DIST_FUNCTIONS:
+        return kernel(_text, _pat, window_size, text_norm=text_norm)
+      return kernel(_text, _pat, window_size)
+
+    _distances = np.ones(len(_text))
     for word_index in range(0, len(_text)):
       _fragment = _text[word_index: word_index + window_size]
       _distances[word_index] = dist_function(_fragment, _pat)
 
     return _distances
 
-  def _eval_distances_multi_window(self, _text, dist_function=DIST_FUNC):
+  def _eval_distances_multi_window(self, _text, dist_function=DIST_FUNC, text_norm=None):
     assert self.embeddings is not None
-    distances = [self._eval_distances(_text, dist_function, whd_padding=0, wnd_mult=1)]
+    if text_norm is None and self.soft_sliding_window_borders and dist_function in TEXT_NORM_DIST_FUNCTIONS:
+      text_norm = normalize_text_rows(_text)
+
+    distances = [self._eval_distances(_text, dist_function, whd_padding=0, wnd_mult=1, text_norm=text_norm)]
 
     if self.soft_sliding_window_borders:
-      distances.append(self._eval_distances(_text, dist_function, whd_padding=2, wnd_mult=1))
-      distances.append(self._eval_distances(_text, dist_function, whd_padding=1, wnd_mult=2))
-      distances.append(self._eval_distances(_text, dist_function, whd_padding=7, wnd_mult=0))
+      distances.append(self._eval_distances(_text, dist_function, whd_padding=2, wnd_mult=1, text_norm=text_norm))
+      distances.append(self._eval_distances(_text, dist_function, whd_padding=1, wnd_mult=2, text_norm=text_norm))
+      distances.append(self._eval_distances(_text, dist_function, whd_padding=7, wnd_mult=0, text_norm=text_norm))
 
     sum = None
     cnt = 0
@@ -140,6 +137,47 @@ class CompoundPattern:
     pass
 
 
+class WinningPatterns(Mapping):
+  """
+  Read-only dict-like {token index: (pattern index, distance)} of the patterns left in every column of
+  ExclusivePattern distances; when several are left, the last one wins.
+
+  Backed by two compact arrays, one value per token:
+    pattern_indexes -- the winning pattern, -1 if none
+    values -- its distance, nan if none
+  """
+
+  def __init__(self, distances_per_pattern):
+    present = ~np.isnan(distances_per_pattern)
+    winners = present.any(0)
+    last = len(present) - 1 - np.argmax(present[::-1], 0)
+    columns = np.arange(present.shape[1])
+
+    self.pattern_indexes = np.where(winners, last, -1)
+    self.values = np.where(winners, distances_per_pattern[last, columns], np.nan)
+
+    # the order of a dict filled pattern by pattern
+    first = np.argmax(present, 0)
+    order = np.lexsort((columns, first))
+    self._order = order[winners[order]]
+
+  def __len__(self):
+    return len(self._order)
+
+  def __iter__(self):
+    return iter(self._order.tolist())
+
+  def __contains__(self, key):
+    if not isinstance(key, (int, np.integer)) or not 0 <= key < len(self.pattern_indexes):
+      return False
+    return self.pattern_indexes[key] >= 0
+
+  def __getitem__(self, key):
+    if key not in self:
+      raise KeyError(key)
+    return int(self.pattern_indexes[key]), self.values[key]
+
+
 class ExclusivePattern(CompoundPattern):
 
   def __init__(self):
@@ -157,13 +195,7 @@ class ExclusivePattern(CompoundPattern):
     :param mask:
     :return:
     """
-    maximals = np.max(a, 0)
-
-    for i in range(a.shape[0]):
-      for j in range(a.shape[1]):
-        if a[i, j] < maximals[j]:
-          a[i, j] = mask
-
+    a[a < np.max(a, 0)] = mask
     return a
 
   def calc_exclusive_distances(self, text_ebd):
@@ -196,12 +228,7 @@ class ExclusivePattern(CompoundPattern):
         print("WARNING: never winning pattern detected! index:", _id, self.patterns[_id])
         ranges.append([np.inf, -np.inf, 0])
 
-    winning_patterns = {}
-    for row_index in range(len(distances_per_pattern)):
-      row = distances_per_pattern[row_index]
-      for col_i in range(len(row)):
-        if not np.isnan(row[col_i]):
-          winning_patterns[col_i] = (row_index, row[col_i])
+    winning_patterns = WinningPatterns(distances_per_pattern)
 
     return distances_per_pattern, ranges, winning_patterns
 
@@ -249,13 +276,25 @@ class CoumpoundFuzzyPattern(CompoundPattern):
     return sums
 
 
+PATTERN_EMBEDDINGS_CACHE_VERSION = 3
+PATTERN_EMBEDDINGS_CACHE_ENV = 'NLP_TOOLS_PATTERNS_CACHE'
+
+
 class AbstractPatternFactory:
 
-  def __init__(self, embedder):
+  def __init__(self, embedder, embeddings_cache_path=None):
+    """
+    :param embeddings_cache_path: .npz file to keep pattern embeddings between runs
+    (defaults to $NLP_TOOLS_PATTERNS_CACHE, no caching if not set)
+    """
     self.embedder = embedder  # TODO: do not keep it here, take as an argument for embedd()
     self.patterns: List[FuzzyPattern] = []
     self.patterns_dict = {}
 
+    if embeddings_cache_path is None:
+      embeddings_cache_path = os.environ.get(PATTERN_EMBEDDINGS_CACHE_ENV)
+    self.embeddings_cache_path = embeddings_cache_path
+
   def create_pattern(self, pattern_name, prefix_pattern_suffix_tuples):
     fp = FuzzyPattern(prefix_pattern_suffix_tuples, pattern_name)
     self.patterns.append(fp)
@@ -263,18 +302,98 @@ class AbstractPatternFactory:
     return fp
 
   def embedd(self):
-    # collect patterns texts
-    arr = []
-    for p in self.patterns:
-      arr.append(p.prefix_pattern_suffix_tuple)
-
-    # =========
-    patterns_emb = self.embedder.embedd_contextualized_patterns(arr)
-    assert len(patterns_emb) == len(self.patterns)
-    # =========
+    """
+    Embeds patterns; with embeddings_cache_path set, only patterns which are not in the cache file yet
+    (new or changed (prefix, pattern, suffix), or another embedder) are sent to the embedder.
 
-    for i in range(len(patterns_emb)):
-      self.patterns[i].set_embeddings(patterns_emb[i])
+    The file may be shared by several factories and processes (see corpus_runner): it is re-read and merged
+    under a file lock right before it is rewritten. Only this factory's namespace (its class and embedder)
+    is pruned then: the entries of it that were not asked for are dropped.
+    """
+    embedder_id = self.embedder.get_embedder_id()
+    if self.embeddings_cache_path is not None and embedder_id is None:
+      print(f'WARNING: {type(self.embedder).__name__} has no model id, pattern embeddings are not cached')
+      cache = {}
+    else:
+      cache = self._load_embeddings_cache()
+    keys = [self._embeddings_cache_key(p) for p in self.patterns]
+    missing = [i for i in range(len(self.patterns)) if keys[i] not in cache]
+
+    if len(missing) > 0:
+      # collect patterns texts
+      arr = []
+      for i in missing:
+        arr.append(self.patterns[i].prefix_pattern_suffix_tuple)
+
+      # =========
+      patterns_emb = self.embedder.embedd_contextualized_patterns(arr)
+      assert len(patterns_emb) == len(missing)
+      # =========
+
+      for i, pattern_emb in zip(missing, patterns_emb):
+        cache[keys[i]] = pattern_emb
+
+      if embedder_id is not None:
+        self._merge_embeddings_cache({keys[i]: cache[keys[i]] for i in missing}, set(keys))
+
+    for i in range(len(self.patterns)):
+      self.patterns[i].set_embeddings(cache[keys[i]])
+
+  def _embeddings_cache_namespace(self) -> str:
+    embedder_id = hashlib.sha1(str(self.embedder.get_embedder_id()).encode('utf-8')).hexdigest()[:12]
+    return f'{type(self).__name__}.{embedder_id}.'
+
+  def _embeddings_cache_key(self, p: FuzzyPattern) -> str:
+    key = json.dumps([self.embedder.get_embedder_id(), p.prefix_pattern_suffix_tuple], ensure_ascii=False)
+    return self._embeddings_cache_namespace() + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+  @contextmanager
+  def _embeddings_cache_lock(self):
+    if fcntl is None:
+      yield
+      return
+
+    with open(self.embeddings_cache_path + '.lock', 'a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+  def _merge_embeddings_cache(self, new_entries: dict, requested: set):
+    if self.embeddings_cache_path is None:
+      return
+
+    namespace = self._embeddings_cache_namespace()
+    with self._embeddings_cache_lock():
+      # what other processes have written since it was read
+      cache = self._load_embeddings_cache()
+      cache.update(new_entries)
+      self._save_embeddings_cache({k: v for k, v in cache.items() if not k.startswith(namespace) or k in requested})
+
+  def _load_embeddings_cache(self) -> dict:
+    if self.embeddings_cache_path is None or not os.path.exists(self.embeddings_cache_path):
+      return {}
+
+    try:
+      with np.load(self.embeddings_cache_path) as data:
+        if '__version__' not in data or int(data['__version__']) != PATTERN_EMBEDDINGS_CACHE_VERSION:
+          print(f'WARNING: ignoring pattern embeddings cache {self.embeddings_cache_path} of another version')
+          return {}
+        return {k: data[k] for k in data.files if k != '__version__'}
+
+    except (IOError, ValueError) as e:
+      print(f'WARNING: cannot read pattern embeddings cache {self.embeddings_cache_path}', e)
+      return {}
+
+  def _save_embeddings_cache(self, cache: dict):
+    if self.embeddings_cache_path is None:
+      return
+
+    tmp_path = f'{self.embeddings_cache_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.savez(f, __version__=np.array(PATTERN_EMBEDDINGS_CACHE_VERSION), **cache)
+    os.replace(tmp_path, self.embeddings_cache_path)
 
   def average_embedding_pattern(self, pattern_prefix):
     av_emb = None
@@ -307,8 +426,8 @@ class AbstractPatternFactory:
 
 
 class AbstractPatternFactoryLowCase(AbstractPatternFactory):
-  def __init__(self, embedder):
-    AbstractPatternFactory.__init__(self, embedder)
+  def __init__(self, embedder, embeddings_cache_path=None):
+    AbstractPatternFactory.__init__(self, embedder, embeddings_cache_path)
     self.patterns_dict = {}
 
   def create_pattern(self, pattern_name, ppp):
@@ -325,21 +444,69 @@ class AbstractPatternFactoryLowCase(AbstractPatternFactory):
     return fp
 
 
-def make_pattern_attention_vector(pat: FuzzyPattern, embeddings, dist_function=DIST_FUNC):
+def make_pattern_attention_vector(pat: FuzzyPattern, embeddings, dist_function=DIST_FUNC, dtype=np.float32,
+                                  text_norm=None):
+  """
+  :param dtype: of the returned vector, see PrecisionPolicy.distances
+  :param text_norm: normalize_text_rows(embeddings), for the dist functions of TEXT_NORM_DIST_FUNCTIONS
+  """
   try:
-    dists = pat._eval_distances_multi_window(embeddings, dist_function)
+    dists = pat._eval_distances_multi_window(embeddings, dist_function, text_norm=text_norm)
 
     # TODO: this inversion must be a part of a dist_function
-    dists = 1.0 - dists
+    dists = np.asarray(1.0 - dists, dtype=dtype)
     # distances_per_pattern_dict[pat.name] = dists
     dists.flags.writeable = False
 
   except Exception as e:
     print('ERROR: calculate_distances_per_pattern ', e)
-    dists = np.zeros(len(embeddings))
+    dists = np.zeros(len(embeddings), dtype=dtype)
   return dists
 
 
+def make_patterns_attention_vectors(patterns: List[FuzzyPattern], embeddings, dist_function=DIST_FUNC,
+                                    dtype=np.float32, text_norm=None) -> List:
+  """
+  Batched make_pattern_attention_vector: patterns having the same window length are stacked
+  and matched against the document in a single pass per window length (see SLIDING_WINDOW_MULTI_KERNELS).
+  Patterns the batch kernels can not handle (a dist_function without one, soft window borders)
+  are evaluated one by one.
+
+  :param dtype: of the returned vectors, see PrecisionPolicy.distances
+  :param text_norm: normalize_text_rows(embeddings); computed here, once for all the patterns, if not given
+  :return: attention vectors, in the order of `patterns`
+  """
+  if text_norm is None and dist_function in TEXT_NORM_DIST_FUNCTIONS and len(patterns) > 0:
+    text_norm = normalize_text_rows(embeddings)
+
+  kernel = SLIDING_WINDOW_MULTI_KERNELS.get(dist_function)
+  vectors = [None] * len(patterns)
+  pattern_indexes_by_window_size = {}
+
+  for i in range(len(patterns)):
+    pat = patterns[i]
+    if kernel is not None and pat.embeddings is not None and len(pat.embeddings) > 0 \
+            and not pat.soft_sliding_window_borders:
+      pattern_indexes_by_window_size.setdefault(len(pat.embeddings), []).append(i)
+    else:
+      vectors[i] = make_pattern_attention_vector(pat, embeddings, dist_function, dtype, text_norm)
+
+  for window_size, indexes in pattern_indexes_by_window_size.items():
+    patterns_emb = [patterns[i].embeddings for i in indexes]
+    if dist_function in TEXT_NORM_DIST_FUNCTIONS:
+      dists = kernel(embeddings, patterns_emb, window_size, text_norm=text_norm)
+    else:
+      dists = kernel(embeddings, patterns_emb, window_size)
+
+    for column, i in enumerate(indexes):
+      # TODO: this inversion must be a part of a dist_function
+      v = np.asarray(1.0 - dists[:, column], dtype=dtype)
+      v.flags.writeable = False
+      vectors[i] = v
+
+  return vectors
+
+
 import random
 
 
@@ -360,13 +527,16 @@ def make_smart_meta_click_pattern(attention_vector, embeddings, name=None):
 """ 💔🛐  ===========================📈=================================  ✂️ """
 
 
-def improve_attention_vector(embeddings, vv, relu_th=0.5, mix=1):
+def improve_attention_vector(embeddings, vv, relu_th=0.5, mix=1, dtype=np.float32):
+  """
+  :param dtype: of the returned vector, see PrecisionPolicy.distances
+  """
   assert vv is not None
   meta_pattern, meta_pattern_confidence, best_id = make_smart_meta_click_pattern(vv, embeddings)
-  meta_pattern_attention_v = make_pattern_attention_vector(meta_pattern, embeddings)
+  meta_pattern_attention_v = make_pattern_attention_vector(meta_pattern, embeddings, dtype=dtype)
   meta_pattern_attention_v = relu(meta_pattern_attention_v, relu_th)
 
-  meta_pattern_attention_v = meta_pattern_attention_v * mix + vv * (1.0 - mix)
+  meta_pattern_attention_v = meta_pattern_attention_v * mix + np.asarray(vv, dtype=dtype) * (1.0 - mix)
   return meta_pattern_attention_v, best_id
 
 
@@ -341,43 +341,31 @@ import numpy as np
 
 
 def mixclr(color_map, dictionary, min_color=None, _slice=None):
-  reds = None
-  greens = None
-  blues = None
+  """
+  :return: tokens x 3 float32 matrix of RGB colors in [0, 1], the attention vectors mixed by the colors of their names
+  """
+  colors = None
 
   fallback = (1, 1, 1)
 
   for c in dictionary:
-    vector = np.array(dictionary[c])
+    vector = np.asarray(dictionary[c], dtype=np.float32)
     if _slice is not None:
       vector = vector[_slice]
 
-    if reds is None:
-      reds = np.zeros(len(vector))
-    if greens is None:
-      greens = np.zeros(len(vector))
-    if blues is None:
-      blues = np.zeros(len(vector))
+    if colors is None:
+      colors = np.zeros((len(vector), 3), dtype=np.float32)
 
     vector_color = fallback
     if c in color_map:
       vector_color = color_map[c]
 
-    reds += vector * vector_color[0]
-    greens += vector * vector_color[1]
-    blues += vector * vector_color[2]
+    colors += np.outer(vector, np.asarray(vector_color, dtype=np.float32))
 
   if min_color is not None:
-    reds += min_color[0]
-    greens += min_color[1]
-    blues += min_color[2]
+    colors += np.asarray(min_color, dtype=np.float32)
 
-  def cut_(x):
-    up = [min(i, 1) for i in x]
-    down = [max(i, 0) for i in up]
-    return down
-
-  return np.array([cut_(reds), cut_(greens), cut_(blues)]).T
+  return np.clip(colors, 0, 1)
 
 
 def to_multicolor_text(tokens, vectors, colormap, min_color=None, _slice=None) -> str:
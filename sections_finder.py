@@ -165,7 +165,7 @@ class FocusingSectionsFinder(SectionsFinder):
     #   v, _ = improve_attention_vector(doc.embeddings, v, relu_th=0.1)
     v *= (headlines_attention_vector + 0.1)
     if max(v) > 0.75:
-      v, _ = improve_attention_vector(doc.embeddings, v, relu_th=0.0)
+      v, _ = improve_attention_vector(doc.embeddings, v, relu_th=0.0, dtype=doc.precision.distances)
 
     doc.distances_per_pattern_dict["ha$." + headline_pattern_prefix] = v
 
@@ -173,6 +173,6 @@ class FocusingSectionsFinder(SectionsFinder):
     best_id = np.argmax(v)
     # dia = slice(max(0, best_id - span), min(best_id + span, len(v)))
 
-    bounds = get_sentence_bounds_at_index(best_id, doc.tokens)
+    bounds = get_sentence_bounds_at_index(best_id, doc.tokens, doc.newlines)
     confidence = v[best_id]
     return bounds, confidence, v
@@ -0,0 +1,158 @@
+import json
+import os
+import signal
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from corpus_runner import run_corpus, read_text_files
+from embedding_tools import AbstractEmbedder
+
+
+class WordsEmbedder(AbstractEmbedder):
+  # the same random point for the same word; takes its time with 'медленно', kills the process with 'падение'
+
+  def embedd_tokenized_text(self, words, lens):
+    if any('падение' in s for s in words):
+      os._exit(1)
+    if any('медленно' in s for s in words):
+      time.sleep(30)
+    emb = [[np.random.RandomState(sum(map(ord, w)) % 2 ** 31).randn(16) for w in s] for s in words]
+    return np.array(emb), words
+
+
+def make_words_embedder():
+  return WordsEmbedder()
+
+
+class StuckEmbedder(WordsEmbedder):
+  # with 'застрял', hangs where SIGALRM can not reach it (as inside a TensorFlow call)
+
+  def embedd_tokenized_text(self, words, lens):
+    if any('застрял' in s for s in words):
+      signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+      time.sleep(60)
+    return super().embedd_tokenized_text(words, lens)
+
+
+def make_stuck_embedder():
+  return StuckEmbedder()
+
+
+def make_slow_matching_embedder():
+  # pattern matching takes longer than the timeout; it is wrapped in `except Exception` blocks
+  import patterns
+
+  def _slow(matching):
+    def _matching(*args, **kwargs):
+      time.sleep(2)
+      return matching(*args, **kwargs)
+
+    return _matching
+
+  for dist_function, kernel in patterns.SLIDING_WINDOW_MULTI_KERNELS.items():
+    patterns.SLIDING_WINDOW_MULTI_KERNELS[dist_function] = _slow(kernel)
+  patterns.FuzzyPattern._eval_distances = _slow(patterns.FuzzyPattern._eval_distances)
+  return WordsEmbedder()
+
+
+CONTRACT = """ДОГОВОР ПОЖЕРТВОВАНИЯ
+1. ПРЕДМЕТ ДОГОВОРА
+1.1. Благотворитель передает Благополучателю пожертвование.
+2. ЦЕНА ДОГОВОРА
+2.1. Сумма пожертвования составляет 1 000 000 (один миллион) рублей.
+"""
+
+
+class CorpusRunnerTestCase(unittest.TestCase):
+
+  def test_run_corpus(self):
+    docs = [('contract', CONTRACT), ('no text', None), ('slow', CONTRACT + 'медленно\n'), ('contract 2', CONTRACT)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+      output_path = os.path.join(tmp, 'results.jsonl')
+      processed, failed = run_corpus(docs, output_path, make_words_embedder, workers=2, timeout=5)
+
+      with open(output_path, encoding='utf-8') as f:
+        records = {r['id']: r for r in map(json.loads, f)}
+
+    self.assertEqual((4, 2), (processed, failed))
+    self.assertEqual(['contract', 'contract 2', 'no text', 'slow'], sorted(records))
+
+    self.assertTrue(records['contract']['ok'])
+    self.assertEqual(records['contract']['result'], records['contract 2']['result'])
+    self.assertIn('subjects', records['contract']['result'])
+
+    self.assertFalse(records['no text']['ok'])
+    self.assertIn('Error', records['no text']['error'])
+
+    self.assertFalse(records['slow']['ok'])
+    self.assertTrue(records['slow']['error'].startswith('DocumentTimeout'))
+    self.assertLess(records['slow']['seconds'], 10)
+
+  def test_run_corpus_worker_died(self):
+    docs = [('contract', CONTRACT), ('crash', CONTRACT + 'падение\n'), ('contract 2', CONTRACT),
+            ('contract 3', CONTRACT), ('contract 4', CONTRACT)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+      output_path = os.path.join(tmp, 'results.jsonl')
+      processed, failed = run_corpus(docs, output_path, make_words_embedder, workers=2, timeout=30)
+
+      with open(output_path, encoding='utf-8') as f:
+        records = [json.loads(line) for line in f]
+
+    self.assertEqual((5, 1), (processed, failed))
+    self.assertEqual(sorted(id for id, _ in docs), sorted(r['id'] for r in records))
+
+    for r in records:
+      if r['id'] == 'crash':
+        self.assertFalse(r['ok'])
+        self.assertTrue(r['error'].startswith('WorkerDied'))
+      else:
+        self.assertTrue(r['ok'], r)
+
+  def test_run_corpus_timeout_in_pattern_matching(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      output_path = os.path.join(tmp, 'results.jsonl')
+      processed, failed = run_corpus([('contract', CONTRACT)], output_path, make_slow_matching_embedder, workers=1,
+                                     timeout=1)
+
+      with open(output_path, encoding='utf-8') as f:
+        record = json.loads(f.readline())
+
+    self.assertEqual((1, 1), (processed, failed))
+    self.assertFalse(record['ok'])
+    self.assertTrue(record['error'].startswith('DocumentTimeout'))
+
+  def test_run_corpus_worker_stuck(self):
+    docs = [('contract', CONTRACT), ('stuck', CONTRACT + 'застрял\n'), ('contract 2', CONTRACT)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+      output_path = os.path.join(tmp, 'results.jsonl')
+      start = time.time()
+      processed, failed = run_corpus(docs, output_path, make_stuck_embedder, workers=2, timeout=1, kill_after=5)
+      elapsed = time.time() - start
+
+      with open(output_path, encoding='utf-8') as f:
+        records = {r['id']: r for r in map(json.loads, f)}
+
+    self.assertEqual((3, 1), (processed, failed))
+    self.assertLess(elapsed, 40)
+    self.assertTrue(records['contract']['ok'])
+    self.assertTrue(records['contract 2']['ok'])
+    self.assertFalse(records['stuck']['ok'])
+    self.assertTrue(records['stuck']['error'].startswith('DocumentTimeout'))
+
+  def test_read_text_files(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'a.txt')
+      with open(path, 'w', encoding='utf-8') as f:
+        f.write('текст')
+
+      self.assertEqual([(path, 'текст')], list(read_text_files([path])))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -12,7 +12,7 @@ from contract_parser import ContractAnlysingContext
 from doc_structure import remove_similar_indexes_considering_weights
 from embedding_tools import AbstractEmbedder
 from legal_docs import *
-from parsing import print_prof_data
+from parsing import print_prof_data, run_pipeline
 from patterns import *
 
 
@@ -66,6 +66,105 @@ class LegalDocumentTestCase(unittest.TestCase):
     # self.assertEqual(1, len(fp2.embeddings))
     # self.assertEqual(3, len(fp3.embeddings))
 
+  def test_embedd_large_in_place(self):
+    class PositionalEmbedder(AbstractEmbedder):
+      def __init__(self):
+        self.calls = 0
+
+      def embedd_tokenized_text(self, words, lens):
+        self.calls += 1
+        return np.array([[[float(w) if w.isdigit() else -1.0] for w in s] for s in words]), words
+
+    ld = LegalDocument()
+    ld.tokens = [str(i) for i in range(23)]
+
+    emb = PositionalEmbedder()
+    ld._embedd_large(emb, 5, max_batch_windows=2)
+
+    self.assertEqual(3, emb.calls)
+    self.assertEqual((23, 1), ld.embeddings.shape)
+    self.assertTrue(np.allclose(ld.embeddings[:, 0], np.arange(23)))
+
+  def test_embedd_large_memmap(self):
+    import os
+    import tempfile
+
+    class PositionalEmbedder(AbstractEmbedder):
+      def embedd_tokenized_text(self, words, lens):
+        return np.array([[[float(w) if w.isdigit() else -1.0, 1.0, 0.5] for w in s] for s in words]), words
+
+    ld = LegalDocument()
+    ld.tokens = [str(i) for i in range(23)]
+    ld.tokens_cc = ld.tokens
+    expected = np.array([[i, 1.0, 0.5] for i in range(23)])
+
+    with tempfile.TemporaryDirectory() as memmap_dir:
+      ld._embedd_large(PositionalEmbedder(), 5, max_batch_windows=2, memmap_dir=memmap_dir)
+
+      self.assertIsInstance(ld.embeddings, np.memmap)
+      self.assertTrue(np.allclose(expected, ld.embeddings))
+      self.assertEqual([], os.listdir(memmap_dir))  # unlinked, lives as long as the mapping
+
+    sub = ld.subdoc_slice(slice(4, 15))
+    self.assertIsInstance(sub.embeddings, np.memmap)
+    self.assertTrue(np.shares_memory(ld.embeddings, sub.embeddings))
+
+    pattern = FuzzyPattern(None, _name='p')
+    pattern.set_embeddings(np.array([[3.0, 1.0, 0.4], [4.0, 1.0, 0.5]]))
+    for dist_function in [dist_mean_cosine, dist_frechet_cosine_undirected]:
+      v = make_pattern_attention_vector(pattern, ld.embeddings, dist_function)
+      self.assertTrue(np.allclose(make_pattern_attention_vector(pattern, expected, dist_function), v))
+
+  def test_precision_float16_vs_float64(self):
+    from ml_tools import PRECISION_FLOAT16, PRECISION_FLOAT64
+    from renderer import mixclr
+
+    class WordsEmbedder(AbstractEmbedder):
+      # the same random 64-d point for the same word
+      def embedd_tokenized_text(self, words, lens):
+        emb = [[np.random.RandomState(sum(map(ord, w)) % 2 ** 31).randn(64) for w in s] for s in words]
+        return np.array(emb), words
+
+    factory = AbstractPatternFactory(WordsEmbedder())
+    factory.create_pattern('p_capital', ('Уставный', 'капитал общества', 'составляет'))
+    factory.create_pattern('p_board', ('', 'совет директоров', ''))
+    factory.create_pattern('p_sum', ('сумма', 'сделки', 'более'))
+    factory.embedd()
+
+    text = 'Уставный капитал общества составляет 100 рублей.\nСовет директоров одобряет сделки,\n' \
+           'сумма сделки более 25 процентов балансовой стоимости активов общества.\n' * 3
+
+    results = {}
+    for precision in [PRECISION_FLOAT64, PRECISION_FLOAT16]:
+      doc = LegalDocument(text)
+      doc.precision = precision
+      doc.parse()
+      doc.embedd(factory)
+      self.assertEqual(precision.embeddings, doc.embeddings.dtype)
+
+      doc.calculate_distances_per_pattern(factory)
+      sub = doc.subdoc_slice(slice(5, 20))
+      self.assertEqual(precision.embeddings, sub.embeddings.dtype)
+      self.assertEqual(precision.distances, sub.distances_per_pattern_dict['p_board'].dtype)
+
+      improved, _ = improve_attention_vector(doc.embeddings, doc.distances_per_pattern_dict['p_sum'],
+                                             dtype=precision.distances)
+      self.assertEqual(precision.distances, improved.dtype)
+
+      results[precision] = (doc.distances_per_pattern_dict, improved)
+
+    expected, expected_improved = results[PRECISION_FLOAT64]
+    distances, improved = results[PRECISION_FLOAT16]
+    for name in expected:
+      self.assertLess(np.max(np.abs(expected[name] - distances[name])), 1e-3, name)
+      # the best match is the same (or as good, the text repeats itself)
+      self.assertAlmostEqual(np.max(expected[name]), expected[name][np.argmax(distances[name])], 3, name)
+    self.assertLess(np.max(np.abs(expected_improved - improved)), 1e-3)
+
+    colors = mixclr({'p_sum': (1, 0, 0.5)}, distances)
+    self.assertEqual(np.float32, colors.dtype)
+    self.assertLess(np.max(np.abs(mixclr({'p_sum': (1, 0, 0.5)}, expected) - colors)), 1e-3)
+
   def test_normalize_sentences_bounds(self):
     d = LegalDocument()
 
@@ -110,6 +209,36 @@ class LegalDocumentTestCase(unittest.TestCase):
 
     print(lll)
 
+  def test_sentence_bounds(self):
+    d = LegalDocument('Первое предложение.\nВторое.\n\nТретье')
+    d.parse()
+
+    for i in range(len(d.tokens)):
+      self.assertEqual(get_sentence_bounds_at_index(i, d.tokens), get_sentence_bounds_at_index(i, d.tokens, d.newlines))
+      self.assertEqual(get_sentence_slices_at_index(i, d.tokens),
+                       get_sentence_slices_at_index(i, d.tokens, d.newlines))
+
+    indexes = list(range(len(d.tokens)))
+    self.assertEqual([find_token_before_index(d.tokens, i, '\n', 0) for i in indexes],
+                     d.find_sentence_beginnings(indexes))
+
+    # the cache follows the tokens
+    d.tokens = d.tokens[:3]
+    self.assertEqual(list(find_newlines(d.tokens)), list(d.newlines))
+
+  def test_roman_numbers(self):
+    from doc_structure import DocumentStructure
+
+    # a single roman number is not a section number, however long the document is
+    ds = DocumentStructure()
+    ds.detect_document_structure('1. Общие положения\nII Права\n' + 'текст\n' * 30)
+    self.assertEqual([], ds.structure[1].number)
+    self.assertEqual(2, ds.structure[1].level)
+
+    ds = DocumentStructure()
+    ds.detect_document_structure('I Общие\nтекст\nII Капитал\nтекст\nIII Права\nтекст\nIV Органы\n')
+    self.assertEqual([[1], [2], [3], [4]], [s.number for s in ds.structure if s.roman])
+
   def test_remove_similar_indexes_considering_weights(self):
     a = []
     w = []
@@ -167,6 +296,122 @@ class LegalDocumentTestCase(unittest.TestCase):
     ctx._logstep("analyze_charter 2")
 
 
+  def test_analyze_charters_same_as_one_by_one(self):
+    class WordsEmbedder(AbstractEmbedder):
+      # the same random point for the same word
+      def __init__(self):
+        self.calls = 0
+
+      def embedd_tokenized_text(self, words, lens):
+        self.calls += 1
+        emb = [[np.random.RandomState(sum(map(ord, w)) % 2 ** 31).randn(16) for w in s] for s in words]
+        return np.array(emb), words
+
+    texts = ['Устав\n1. ОБЩИЕ ПОЛОЖЕНИЯ\n1.1. Общество с ограниченной ответственностью «Газпром».\n'
+             '2. КОМПЕТЕНЦИЯ СОВЕТА ДИРЕКТОРОВ\n2.1. Совет директоров одобряет сделки на сумму более 25 000 000 рублей.\n',
+             '1. ЮРИДИЧЕСКИЙ содержание 4.',
+             'Устав\n1. ОБЩИЕ ПОЛОЖЕНИЯ\nОбщество вправе.\n']
+
+    embedder = WordsEmbedder()
+    ctx = CharterDocumentParser(CharterPatternFactory(embedder))
+
+    expected = []
+    for text in texts:
+      ctx.analyze_charter(text)
+      expected.append(ctx.doc)
+
+    calls = embedder.calls
+    charters = ctx.analyze_charters(texts, batch_size=2)
+    self.assertEqual(2, embedder.calls - calls)
+
+    for e, charter in zip(expected, charters):
+      self.assertTrue(np.array_equal(e.embeddings, charter.embeddings))
+      self.assertEqual(list(e.distances_per_pattern_dict), list(charter.distances_per_pattern_dict))
+      for name in e.distances_per_pattern_dict:
+        self.assertTrue(np.array_equal(e.distances_per_pattern_dict[name], charter.distances_per_pattern_dict[name]))
+      self.assertEqual(e.org['name'], charter.org['name'])
+      self.assertEqual(list(e.sections), list(charter.sections))
+      self.assertEqual(len(e._constraints), len(charter._constraints))
+
+  def test_analyze_contracts_same_as_one_by_one(self):
+    from renderer import SilentRenderer
+
+    class WordsEmbedder(AbstractEmbedder):
+      # the same random point for the same word
+      def embedd_tokenized_text(self, words, lens):
+        emb = [[np.random.RandomState(sum(map(ord, w)) % 2 ** 31).randn(16) for w in s] for s in words]
+        return np.array(emb), words
+
+    texts = ['ДОГОВОР ПОЖЕРТВОВАНИЯ\n1. ПРЕДМЕТ ДОГОВОРА\n1.1. Благотворитель передает Благополучателю пожертвование.\n'
+             '2. ЦЕНА ДОГОВОРА\n2.1. Сумма пожертвования составляет 1 000 000 (один миллион) рублей.\n',
+             'ДОГОВОР АРЕНДЫ\n1. Арендодатель передает Арендатору помещение.\n',
+             '1. ЦЕНА\nСтоимость услуг 300 000 рублей.\n']
+
+    ctx = ContractAnlysingContext(WordsEmbedder(), SilentRenderer())
+    expected = [ctx.analyze_contract(text) for text in texts]
+
+    results = list(ctx.analyze_contracts(texts))
+    self.assertEqual(len(texts), len(results))
+    for (e, e_values), (doc, values) in zip(expected, results):
+      self.assertTrue(np.array_equal(e.embeddings, doc.embeddings))
+      self.assertEqual(list(e.sections), list(doc.sections))
+      self.assertEqual([v.value.value for v in e_values], [v.value.value for v in values])
+      self.assertEqual([(s.value, s.confidence) for s in e.subjects], [(s.value, s.confidence) for s in doc.subjects])
+
+  def test_run_pipeline(self):
+    import threading
+    import time
+
+    busy = set()
+    overlaps = []
+
+    def stage(name):
+      def _stage(x):
+        busy.add(name)
+        time.sleep(0.02)
+        overlaps.append(len(busy))
+        busy.discard(name)
+        return x + [name]
+
+      return _stage
+
+    items = [[i] for i in range(6)]
+    results = list(run_pipeline(items, [stage('parse'), stage('embedd'), stage('analyze')]))
+    self.assertEqual([[i, 'parse', 'embedd', 'analyze'] for i in range(6)], results)
+    self.assertGreater(max(overlaps), 1)
+
+    self.assertEqual([2, 3], list(run_pipeline([1, 2], [lambda x: x + 1])))
+
+    def fail(x):
+      if x == 3:
+        raise ValueError(x)
+      return x
+
+    threads = threading.active_count()
+    with self.assertRaises(ValueError):
+      list(run_pipeline(range(10), [fail, lambda x: x, lambda x: x]))
+    self.assertEqual(threads, threading.active_count())
+
+    # the consumer stops early: the stage threads stop too
+    for x in run_pipeline(range(100), [lambda x: x, lambda x: x]):
+      break
+    self.assertEqual(threads, threading.active_count())
+
+  def test_embedd_documents_windows(self):
+    class PositionalEmbedder(AbstractEmbedder):
+      def embedd_tokenized_text(self, words, lens):
+        return np.array([[[float(w) if w.isdigit() else -1.0] for w in s] for s in words]), words
+
+    docs = []
+    for n in [23, 4, 11]:
+      ld = LegalDocument()
+      ld.tokens = [str(i) for i in range(n)]
+      docs.append(ld)
+
+    embedd_documents(docs, PositionalEmbedder(), max_tokens=5, max_batch_tokens=20)
+    for ld in docs:
+      self.assertTrue(np.allclose(np.arange(len(ld.tokens)), ld.embeddings[:, 0]))
+
   def test_embedd_headlines(self):
     charter_text_1 = """
         e
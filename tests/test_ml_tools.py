@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+
+from ml_tools import *
+from ml_tools import _extremums_loop, _make_echo_loop, _momentum_loop, _momentum__loop, _momentum_reversed_loop
+
+
+class AttentionKernelsTestCase(unittest.TestCase):
+
+  def test_same_as_loops(self):
+    np.random.seed(3)
+    for size in [0, 1, 2, 3, 50, 3000]:
+      x = np.random.rand(size) * 2 - 0.5
+      x[x < 0.3] = 0
+      if size > 10:
+        x[5] = np.nan
+
+      for decay in [0.7, 0.95, 0.999, 1.0]:
+        self.assertTrue(np.allclose(_momentum_loop(x, decay), momentum(x, decay), equal_nan=True))
+        self.assertTrue(np.allclose(_momentum_reversed_loop(x, decay), momentum_reversed(x, decay), equal_nan=True))
+        self.assertTrue(np.allclose(_momentum__loop(x, decay), momentum_(x, decay), atol=1e-12, equal_nan=True))
+
+      self.assertTrue(np.array_equal(_make_echo_loop(x, 0.5), make_echo(x, 0.5), equal_nan=True))
+      self.assertEqual(_extremums_loop(x), extremums(x))
+
+  def test_momentum_long_fast_decay(self):
+    # 0.7 ** -3000 overflows, the kernel must work in blocks
+    x = np.random.rand(3000)
+    self.assertTrue(np.allclose(_momentum_loop(x, 0.7), momentum(x, 0.7)))
+    self.assertTrue(np.allclose(_momentum__loop(x, 0.7), momentum_(x, 0.7)))
+
+  def test_extremums(self):
+    self.assertEqual([0, 1, 4], extremums([0, 1, 0, 0, 2, 1, 1]))
+
+
+class SmoothTestCase(unittest.TestCase):
+
+  @staticmethod
+  def _smooth_convolve(x, window_len, window):
+    s = np.r_[x[window_len - 1:0:-1], x, x[-2:-window_len - 1:-1]]
+    w = np.ones(window_len) if window == 'flat' else getattr(np, window)(window_len)
+    y = np.convolve(w / w.sum(), s, mode='valid')
+    return y[int(window_len / 2) - 1:-int(window_len / 2)]
+
+  def test_same_as_convolve(self):
+    np.random.seed(5)
+    x = np.random.rand(3000)
+    x[x < 0.7] = 0
+
+    for window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
+      for window_len in [3, 10, 60, FFT_SMOOTH_MIN_WINDOW, 1000]:
+        expected = self._smooth_convolve(x, window_len, window)
+        y = smooth(x, window_len, window)
+        self.assertEqual(len(expected), len(y))
+        self.assertTrue(np.allclose(expected, y, atol=1e-14), (window, window_len))
+        self.assertTrue(np.array_equal(expected == 0, y == 0), (window, window_len))
+
+  def test_fft_keeps_small_values(self):
+    # only round-off is snapped to zero: small (and negative) values of the exact result are kept
+    x = np.zeros(3000)
+    x[1000:1100] = 1e-6
+    x[2000:2100] = -1e-5
+    x[2500] = 1
+
+    y = smooth(x, FFT_SMOOTH_MIN_WINDOW)
+    expected = self._smooth_convolve(x, FFT_SMOOTH_MIN_WINDOW, 'hanning')
+    self.assertTrue(np.allclose(expected, y, rtol=1e-6, atol=1e-15))
+    self.assertTrue(np.array_equal(expected < 0, y < 0))
+    self.assertTrue(np.array_equal(expected == 0, y == 0))
+
+  def test_smooth_rows(self):
+    np.random.seed(6)
+    x = np.random.rand(4, 500)
+
+    for window_len in [2, 12, 300]:
+      y = smooth_rows(x, window_len)
+      self.assertEqual(x.shape, y.shape)
+      for row, smoothed in zip(x, y):
+        self.assertTrue(np.allclose(smooth(row, window_len), smoothed))
+
+  def test_smoothing_window_cached(self):
+    w = get_smoothing_window('hanning', 60)
+    self.assertIs(w, get_smoothing_window('hanning', 60))
+    self.assertAlmostEqual(1, w.sum())
+    self.assertFalse(w.flags.writeable)
+    self.assertRaises(ValueError, get_smoothing_window, 'np.ones', 60)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -14,6 +14,21 @@ class CoumpoundFuzzyPatternTestCase(unittest.TestCase):
     print(m)
     self.assertTrue(np.allclose(m, np.array([[3, mask, mask], [mask, 3, 5]])))
 
+  def test_sum_and_count_nonzero_by_segments(self):
+    from ml_tools import sum_and_count_nonzero_by_segments
+    from text_tools import get_sentence_slices
+
+    tokens = ['a', 'b', '\n', '\n', 'c', 'd', 'e', '\n', 'f']
+    x = np.array([0.5, 1, 7, 7, 0, 2, 0.5, 7, 0.9])
+
+    starts, ends = get_sentence_slices(tokens)
+    self.assertEqual([1, 3, 4, 8], list(starts))
+    self.assertEqual([2, 3, 7, 9], list(ends))
+
+    sums, counts = sum_and_count_nonzero_by_segments(x, starts, ends)
+    self.assertTrue(np.allclose([1, 0, 2.5, 0.9], sums))
+    self.assertEqual([1, 0, 2, 1], list(counts))
+
   def test_exclusive_find(self):
     point1 = [1, 3]
     point2 = [1, 7]
@@ -42,6 +57,18 @@ class CoumpoundFuzzyPatternTestCase(unittest.TestCase):
     print("ranges")
     print(ranges)
 
+    self.assertEqual([1, 0, 1, 1, 1], list(winning_patterns.pattern_indexes))
+    self.assertEqual([1, 0, 2, 3, 4], list(winning_patterns))
+    self.assertEqual(0, winning_patterns[1][0])
+    self.assertTrue(np.allclose(np.nanmin(distances_per_pattern, 0), winning_patterns.values))
+
+  def test_onehot_column_replacement(self):
+    from ml_tools import onehot_column
+
+    a = np.array([[3.0, 2, np.nan], [2, 3, 5]])
+    m = onehot_column(a, -1, replacement=7)
+    self.assertTrue(np.array_equal(np.array([[7, -1, 7], [-1, 7, 7]]), m))
+
   def test_tokenize_doc(self):
     doc = LegalDocument()
     tokens = doc.tokenize('aa bb cc')
@@ -169,6 +196,96 @@ class CoumpoundFuzzyPatternTestCase(unittest.TestCase):
     #
     # self.assertEqual(2, np.argmin(distances))
 
+  def test_eval_distances_vectorized_same_as_loop(self):
+    np.random.seed(42)
+    text_emb = np.random.randn(50, 8)
+
+    pattern = FuzzyPattern(None, _name='random pattern')
+    pattern.set_embeddings(np.random.randn(3, 8) + 1)
+
+    for padding, mult in [(0, 1), (2, 1), (1, 2), (7, 0), (0, 30)]:
+      window_size = mult * len(pattern.embeddings) + padding
+      expected = np.array([dist_mean_cosine(text_emb[i:i + window_size], pattern.embeddings)
+                           for i in range(len(text_emb))])
+
+      distances = pattern._eval_distances(text_emb, whd_padding=padding, wnd_mult=mult)
+      self.assertTrue(np.allclose(expected, distances), (padding, mult))
+
+    distances = dist_mean_cosine_sliding_window(text_emb, pattern.embeddings, 4, block_size=7)
+    expected = pattern._eval_distances(text_emb, whd_padding=1, wnd_mult=1)
+    self.assertTrue(np.allclose(expected, distances))
+
+  def test_eval_distances_cdist_kernels_same_as_loop(self):
+    from text_tools import dist_cosine_min_reductions_sliding_window, normalize_rows, normalize_text_rows
+    np.random.seed(13)
+    text_emb = np.random.randn(40, 6)
+    text_emb[17] = 0
+
+    pattern = FuzzyPattern(None, _name='random pattern')
+    pattern.set_embeddings(np.random.randn(3, 6) + 1)
+
+    for distance_function in [dist_frechet_cosine_undirected, dist_frechet_cosine_directed,
+                              dist_cosine_housedorff_undirected, dist_cosine_housedorff_directed,
+                              dist_cosine_min_mean]:
+      for padding, mult in [(0, 1), (2, 1), (7, 0), (0, 30)]:
+        window_size = mult * len(pattern.embeddings) + padding
+        expected = np.array([distance_function(text_emb[i:i + window_size], pattern.embeddings)
+                             for i in range(len(text_emb))])
+
+        distances = pattern._eval_distances(text_emb, distance_function, whd_padding=padding, wnd_mult=mult)
+        # undirected distances are rounded to 0.01, float32 may round the other way
+        self.assertTrue(np.allclose(expected, distances, atol=0.0101, equal_nan=True), distance_function.__name__)
+
+        distances_normalized_once = pattern._eval_distances(text_emb, distance_function, whd_padding=padding,
+                                                            wnd_mult=mult, text_norm=normalize_text_rows(text_emb))
+        self.assertTrue(np.array_equal(distances, distances_normalized_once, equal_nan=True))
+
+    text_norm, pattern_norm = normalize_rows(text_emb), normalize_rows(pattern.embeddings)
+    expected = dist_cosine_min_reductions_sliding_window(text_norm, pattern_norm, 4, np.maximum)
+    distances = dist_cosine_min_reductions_sliding_window(text_norm, pattern_norm, 4, np.maximum, block_size=7)
+    self.assertTrue(np.allclose(expected, distances, equal_nan=True))
+
+  def test_sentence_similarity_matrix_same_as_loop(self):
+    from text_tools import PAIRWISE_KERNELS, _cosine_min_reductions
+    np.random.seed(11)
+
+    sentences = [np.random.randn(l, 5) for l in [1, 3, 7, 3, 12, 2]]
+    for emb in [sentences, np.random.randn(5, 4, 5)]:
+      for distance_function in list(PAIRWISE_KERNELS) + [dist_mean_eucl]:
+        expected = np.array([[distance_function(u, v) for v in emb] for u in emb])
+        mtx = sentence_similarity_matrix(emb, distance_function)
+        self.assertTrue(np.allclose(expected, mtx, atol=1e-12), distance_function.__name__)
+
+    # tiny blocks: one sentence at a time
+    self.assertTrue(np.allclose(_cosine_min_reductions(sentences, np.add),
+                                _cosine_min_reductions(sentences, np.add, max_block_elements=1)))
+
+  def test_make_patterns_attention_vectors_batched(self):
+    np.random.seed(7)
+    text_emb = np.random.randn(40, 6)
+
+    patterns = []
+    for i, l in enumerate([1, 3, 3, 2, 3, 1]):
+      p = FuzzyPattern(None, _name=f'p{i}')
+      p.set_embeddings(np.random.randn(l, 6) + 1)
+      patterns.append(p)
+    patterns[2].soft_sliding_window_borders = True
+
+    for distance_function in SLIDING_WINDOW_MULTI_KERNELS:
+      vectors = make_patterns_attention_vectors(patterns, text_emb, distance_function)
+      self.assertEqual(len(patterns), len(vectors))
+
+      for p, v in zip(patterns, vectors):
+        expected = make_pattern_attention_vector(p, text_emb, distance_function)
+        # undirected distances are rounded to 0.01, float32 may round the other way
+        self.assertTrue(np.allclose(expected, v, atol=0.0101), (distance_function.__name__, p.name))
+        self.assertFalse(v.flags.writeable)
+
+    # kernel errors are not hidden
+    wrong_dim = FuzzyPattern(None, _name='wrong dim')
+    wrong_dim.set_embeddings(np.random.randn(2, 5) + 1)
+    self.assertRaises(ValueError, make_patterns_attention_vectors, [wrong_dim], text_emb)
+
   def test_coumpound_find(self):
     point1 = [1, 3]
     point2 = [1, 7]
@@ -54,6 +54,220 @@ class CoumpoundFuzzyPatternTestCase(unittest.TestCase):
 
 
 
+    def test_embedd_bucketed(self):
+        from embedding_tools import embedd_tokenized_sentences_bucketed, make_length_buckets
+
+        class NumbersEmbedder(AbstractEmbedder):
+            def __init__(self):
+                self.batches = []
+
+            def embedd_tokenized_text(self, words, lens):
+                self.batches.append(words.shape)
+                emb = [[[float(w) if w != ' ' else -1.0] for w in s] for s in words]
+                return np.array(emb), words
+
+        sentences = [['1'] * 300, ['2', '2'], ['3'], ['4'] * 5, []]
+        sentences_copy = [list(s) for s in sentences]
+
+        embedder = NumbersEmbedder()
+        emb, wrds, lens = embedd_tokenized_sentences_bucketed(embedder, sentences, max_batch_tokens=20)
+
+        self.assertEqual(sentences_copy, sentences)
+        self.assertEqual([300, 2, 1, 5, 0], lens)
+        self.assertEqual(sentences, wrds)
+        for i in range(len(sentences)):
+            self.assertEqual((lens[i], 1), emb[i].shape)
+            self.assertTrue(np.all(emb[i] == i + 1))
+
+        # the 300-tokens outlier is embedded alone
+        self.assertIn((1, 300), embedder.batches)
+        self.assertEqual([[0, 1, 2, 3], [4]], make_length_buckets([1, 2, 2, 5, 300], 20))
+
+    def test_caching_embedder(self):
+        import os
+        import tempfile
+        from embedding_tools import CachingEmbedder
+
+        class CountingEmbedder(FakeEmbedder):
+            calls = 0
+
+            def embedd_tokenized_text(self, tokenized_sentences_list, lens):
+                self.calls += 1
+                return super().embedd_tokenized_text(tokenized_sentences_list, lens)
+
+        inner = CountingEmbedder([1, 6, 4])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            embedder = CachingEmbedder(inner, cache_dir, 'fake')
+
+            emb, _ = embedder.embedd_tokenized_text([['a', 'b', 'c']], [3])
+            self.assertEqual(1, inner.calls)
+
+            emb2, _ = embedder.embedd_tokenized_text([['a', 'b', 'c']], [3])
+            self.assertEqual(1, inner.calls)
+            self.assertTrue(np.allclose(emb, emb2))
+            self.assertEqual((1, 3, 3), emb2.shape)
+
+            # one hit, one miss
+            emb3, _ = embedder.embedd_tokenized_text(np.array([['a', 'b', 'c'], ['d', ' ', ' ']]), [3, 1])
+            self.assertEqual(2, inner.calls)
+            self.assertEqual((2, 3, 3), emb3.shape)
+            self.assertTrue(np.allclose(emb3[1, 0], [1, 6, 4]))
+
+            # other embedder identity
+            CachingEmbedder(inner, cache_dir, 'other').embedd_tokenized_text([['a', 'b', 'c']], [3])
+            self.assertEqual(3, inner.calls)
+
+            # size-based eviction keeps the most recent file only
+            small = CachingEmbedder(inner, cache_dir, 'fake', max_size_bytes=200)
+            small.embedd_tokenized_text([['x']], [1])
+            self.assertEqual(1, len(os.listdir(cache_dir)))
+
+    def test_caching_embedder_dtype_and_lru(self):
+        import os
+        import tempfile
+        from embedding_tools import CachingEmbedder
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            embedder = CachingEmbedder(FakeEmbedder([1.1, 6.3, 4.7]), cache_dir, 'fake', dtype=np.float16)
+
+            cold, _ = embedder.embedd_tokenized_text([['a', 'b']], [2])
+            warm, _ = embedder.embedd_tokenized_text([['a', 'b']], [2])
+            self.assertEqual(np.float16, cold.dtype)
+            self.assertTrue(np.array_equal(cold, warm))
+
+            # overwriting a file does not count it twice
+            size = embedder._size_bytes
+            embedder._store(embedder._path(['a', 'b']), cold[0])
+            self.assertEqual(size, embedder._size_bytes)
+
+            # equal mtimes (coarse timestamps): the least recently used file still goes first
+            embedder.embedd_tokenized_text([['c']], [1])
+            embedder.embedd_tokenized_text([['a', 'b']], [2])
+            for f in embedder._cached_files():
+                os.utime(f, (1000000000, 1000000000))
+
+            embedder.max_size_bytes = embedder._size_bytes
+            embedder.embedd_tokenized_text([['d']], [1])
+            self.assertFalse(os.path.exists(embedder._path(['c'])))
+            self.assertTrue(os.path.exists(embedder._path(['a', 'b'])))
+            self.assertTrue(os.path.exists(embedder._path(['d'])))
+
+    def test_caching_embedder_threads(self):
+        import os
+        import tempfile
+        import threading
+        from embedding_tools import CachingEmbedder
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            embedder = CachingEmbedder(FakeEmbedder([1, 6, 4]), cache_dir, 'fake')
+            errors = []
+
+            def _embedd():
+                try:
+                    for i in range(200):
+                        embedder.embedd_tokenized_text([['a', str(i)]], [2])
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=_embedd) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertEqual([], errors)
+            self.assertEqual(200, len(os.listdir(cache_dir)))  # no temporary files left behind
+
+    def test_embedd_with_cache(self):
+        import os
+        import tempfile
+
+        class CountingEmbedder(FakeEmbedder):
+            patterns_embedded = 0
+
+            def embedd_contextualized_patterns(self, patterns):
+                self.patterns_embedded += len(patterns)
+                return super().embedd_contextualized_patterns(patterns)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, 'patterns.npz')
+
+            embedder = CountingEmbedder([1, 6, 4])
+            PF = AbstractPatternFactory(embedder, cache_path)
+            PF.create_pattern('p1', ('prefix', 'pat 2', 'suffix'))
+            PF.create_pattern('p2', ('prefix', 'pat', 'suffix 2'))
+            PF.embedd()
+            self.assertEqual(2, embedder.patterns_embedded)
+
+            embedder = CountingEmbedder([1, 6, 4])
+            PF = AbstractPatternFactory(embedder, cache_path)
+            fp1 = PF.create_pattern('p1', ('prefix', 'pat 2', 'suffix'))
+            PF.create_pattern('p2', ('prefix', 'pat', 'suffix 2 changed'))
+            PF.create_pattern('p3', ('', 'a b c', ''))
+            PF.embedd()
+
+            # only the changed and the new pattern are re-embedded
+            self.assertEqual(2, embedder.patterns_embedded)
+            self.assertEqual(2, len(fp1.embeddings))
+            self.assertEqual(3, len(PF.patterns_dict['p3'].embeddings))
+
+            # the old version of p2 is dropped from the file, the patterns of other factories are kept
+            class OtherPatternFactory(AbstractPatternFactory):
+                pass
+
+            other = OtherPatternFactory(embedder, cache_path)
+            other.create_pattern('o1', ('', 'other', ''))
+            other.embedd()
+            with np.load(cache_path) as data:
+                self.assertEqual(4, len(data.files) - 1)
+
+            PF = AbstractPatternFactory(embedder, cache_path)
+            PF.create_pattern('p4', ('', 'new', ''))
+            PF.embedd()
+            with np.load(cache_path) as data:
+                self.assertEqual(2, len(data.files) - 1)
+
+            # no model identity, no caching
+            class AnonymousEmbedder(CountingEmbedder):
+                def get_embedder_id(self):
+                    return None
+
+            os.remove(cache_path)
+            PF = AbstractPatternFactory(AnonymousEmbedder([1, 6, 4]), cache_path)
+            PF.create_pattern('p1', ('prefix', 'pat 2', 'suffix'))
+            PF.embedd()
+            self.assertEqual(1, PF.embedder.patterns_embedded)
+            self.assertFalse(os.path.exists(cache_path))
+
+    def test_embedd_with_shared_cache(self):
+        import os
+        import tempfile
+
+        class OtherPatternFactory(AbstractPatternFactory):
+            pass
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_path = os.path.join(cache_dir, 'patterns.npz')
+
+            other = OtherPatternFactory(FakeEmbedder([1, 6, 4]), cache_path)
+            other.create_pattern('o1', ('', 'other', ''))
+
+            class InterleavedEmbedder(FakeEmbedder):
+                # another process writes the cache while this one is embedding
+                def embedd_contextualized_patterns(self, patterns):
+                    other.embedd()
+                    return super().embedd_contextualized_patterns(patterns)
+
+            PF = AbstractPatternFactory(InterleavedEmbedder([1, 6, 4]), cache_path)
+            PF.create_pattern('p1', ('prefix', 'pat', 'suffix'))
+            PF.embedd()
+
+            with np.load(cache_path) as data:
+                names = [k for k in data.files if k != '__version__']
+            self.assertEqual(2, len(names))
+            self.assertTrue(any(k.startswith('OtherPatternFactory.') for k in names))
+            self.assertTrue(any(k.startswith('AbstractPatternFactory.') for k in names))
+
     def test_coumpound_find(self):
         point1 = [1, 3, 7]
         point2 = [1, 7, 4]
@@ -77,6 +77,66 @@ class SplitSectionsTest(unittest.TestCase):
         print(sentence_starts)
         self.assertTrue(np.allclose(sentence_starts, [3, 0]))
 
+    def test_distances_per_pattern_prefix(self):
+        d = DistancesPerPattern()
+        d['a.1'] = [1, 2, 3]
+        d['b.1'] = [4, 5, 6]
+        d['a.2'] = [7, 8, 9]
+        d['a.3'] = [0, 0, 1]
+
+        self.assertEqual(['a.1', 'b.1', 'a.2', 'a.3'], list(d.keys()))
+        self.assertEqual(np.float32, d['a.1'].dtype)
+        self.assertFalse(d['a.1'].flags.writeable)
+
+        self.assertEqual(3, len(filter_values_by_key_prefix(d, 'a.')))
+        self.assertTrue(np.allclose(d.values_by_prefix('a.'), [[1, 2, 3], [7, 8, 9], [0, 0, 1]]))
+        self.assertEqual(0, len(filter_values_by_key_prefix(d, 'c.')))
+        self.assertTrue(np.allclose(max_exclusive_pattern_by_prefix(d, 'a.'), [7, 8, 9]))
+
+        with self.assertRaises(ValueError):
+            d['wrong_len'] = [1, 2]
+
+    def test_distances_per_pattern_read_only(self):
+        d = DistancesPerPattern({'a': [1, 2, 3]})
+
+        with self.assertRaises(ValueError):
+            d['a'] += 1
+        with self.assertRaises(ValueError):
+            d['a'][0] = 5
+        self.assertTrue(np.allclose(d['a'], [1, 2, 3]))
+
+        d['a'] = d['a'] + 1
+        self.assertTrue(np.allclose(d['a'], [2, 3, 4]))
+
+        v = np.array(d['a'])
+        v[0] = 5
+        self.assertTrue(np.allclose(d['a'], [2, 3, 4]))
+
+        # one length for all vectors
+        with self.assertRaises(ValueError):
+            d['longer'] = [1, 2, 3, 4]
+        with self.assertRaises(ValueError):
+            d['a'] = [1, 2]
+        self.assertEqual(['a'], list(d.keys()))
+
+    def test_distances_per_pattern_slice(self):
+        d = DistancesPerPattern({'a': np.arange(10), 'b': np.arange(10) * 2})
+        sub = d.slice(slice(2, 5))
+
+        self.assertTrue(np.allclose(sub['a'], [2, 3, 4]))
+        self.assertTrue(np.shares_memory(sub['b'], d['b']))
+
+        # copy-on-write both ways
+        sub['a'] = [0, 0, 0]
+        d['b'] = np.zeros(10)
+        d['c'] = np.ones(10)
+        self.assertTrue(np.allclose(d['a'][2:5], [2, 3, 4]))
+        self.assertTrue(np.allclose(sub['b'], [4, 6, 8]))
+        self.assertFalse('c' in sub)
+
+        sub['c'] = [1, 1, 1]
+        self.assertEqual(['a', 'b', 'c'], list(sub.keys()))
+
     def test_remove_near_indexes_1(self):
         indexes = [0,0,0]
         filtered = remove_similar_indexes(indexes)
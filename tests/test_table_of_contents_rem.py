@@ -5,7 +5,9 @@
 
 import unittest
 
-from text_normalize import normalize_text, replacements_regex
+import time
+
+from text_normalize import normalize_text, replacements_regex, remove_table_of_contents
 
 
 class TableOfContentsRemovalTest(unittest.TestCase):
@@ -435,3 +437,38 @@ TABLE OF CONTENTS
 
         self.assertTrue(len(normal_text) < len(t) * 0.9)
 
+    def test_remove_wrapped_titles(self):
+        t = 'Устав\nСОДЕРЖАНИЕ\n\nСтатья   Стр.\n\n1. Общие положения   3\n\n' \
+            'Статья 2. Уставный капитал\nи акции   5\n\n3.\nРеорганизация\n7\n\n1. Общие положения\n'
+
+        self.assertEqual('Устав\n\n1. Общие положения\n', remove_table_of_contents(t))
+
+    def test_keep_text_without_entries(self):
+        t = 'Содержание\n\nнастоящего договора\n\n1. Общие положения\n'
+        self.assertEqual(t, remove_table_of_contents(t))
+
+    def test_linear_time(self):
+        # these took the old regex minutes; twice the text must take about twice the time, not four times
+        # (absolute timings are left to benchmarks/bench_normalize_text.py)
+        make_texts = [
+            lambda n: 'содержание\n\n1.' + ' ' * (20 * n) + 'x',
+            lambda n: 'СОДЕРЖАНИЕ\n\n' + '1. Общие положения 3\n' * n,
+            lambda n: 'содержание\n \n1. а\n' * n,
+        ]
+
+        def best_time(text):
+            best = None
+            for _ in range(3):
+                start = time.perf_counter()
+                remove_table_of_contents(text)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+
+        for make_text in make_texts:
+            ratio = best_time(make_text(20000)) / best_time(make_text(10000))
+            self.assertLess(ratio, 3, make_text(1)[:20])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,6 +13,7 @@ class TestTextNormalization(unittest.TestCase):
 
     def _testNorm(self, a, b):
         _norm = normalize_text(a, replacements_regex)
+        self.assertEqual(_norm, normalize_text(a, fused_replacements_regex))
         # _norm2 = normalize_text(_norm, replacements_regex)
         if not _norm == b:
             self.fail('\n'+_norm+' <> \n'+b)
@@ -0,0 +1,50 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# coding=utf-8
+
+
+import unittest
+
+from doc_structure import DocumentStructure
+from text_tools import tokenize_text, tokenize_text_fast
+
+
+class TokenizerTestCase(unittest.TestCase):
+
+  def test_same_tokens_as_nltk(self):
+    texts = [
+      '',
+      '\n\n',
+      '1. ЮРИДИЧЕСКИЙ содержание 4.',
+      'Ай да А.С. Пушкин! Ай да сукин сын!',
+      'ст. 5 ФЗ «Об АО», т.е. (далее – "Общество") 1 000,00 руб.; и т.д.',
+      'сумма 10.5 млн. руб. и т. п...\n  2.1. Общество вправе: ',
+      'a:b, 1,5 , 3:4 [x] {y} <z> @#$%& -- a---b *',
+      'e-mail: info@mail.ru http://x.ru/a?b=1',
+      'Статья 1. Общие положения. Дальше.\n(см. п. 3.)\t"Устав".',
+      "Общество's 'x' `y` cannot",
+    ]
+
+    for text in texts:
+      self.assertEqual(tokenize_text(text), tokenize_text_fast(text), text)
+
+  def test_document_structure_tokenizer(self):
+    text = """
+        1. ЮРИДИЧЕСКИЙ содержание 4.
+        2. ЮРИДИЧЕСКИЙ СТАТУС.
+
+            1. Общество является юридическим лицом согласно законодательству (см. ст. 5).
+        3. УСТАВНЫЙ КАПИТАЛ.
+        """
+
+    nltk_structure = DocumentStructure(tokenizer=tokenize_text)
+    tokens, tokens_cc = nltk_structure.detect_document_structure(text)
+
+    structure = DocumentStructure()
+    self.assertEqual((tokens, tokens_cc), structure.detect_document_structure(text))
+    self.assertEqual([s.span for s in nltk_structure.structure], [s.span for s in structure.structure])
+    self.assertEqual(nltk_structure.headline_indexes, structure.headline_indexes)
+
+
+if __name__ == '__main__':
+  unittest.main()
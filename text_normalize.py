@@ -5,6 +5,11 @@
 
 import re
 
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
 spaces_regex = [
     (re.compile(r'\t'), ' '),
     (re.compile(r'[ ]{2}'), ' '),
@@ -87,13 +92,222 @@ tables_regex = [
 #     (re.compile(r'\|'), ' '),
 ]
 
-table_of_contents_regex = [
-    (re.compile(r'(содержание|оглавление)\s+(^.+?$)?\s+'
-								r'((^\s*(статья\s+)?\d{1,3}\.?\s*(.+?|(.+$\s*^.+?))\s+\d{1,5}$)\s*(^\.*?$))+',
-                re.IGNORECASE|re.MULTILINE),
-     ''),
+# ----------------------------------------------------------------
+# TABLE OF CONTENTS
+# a line scanner instead of a regex: every line is looked at a bounded number
+# of times, so the time is linear in the length of the text
+# ----------------------------------------------------------------
+
+_TOC_HEADING_RE = re.compile(r'(содержание|оглавление)\s*$', re.IGNORECASE)
+_TOC_HEADING_ANY_RE = re.compile(r'содержание|оглавление', re.IGNORECASE)
+_TOC_ENTRY_NUMBER_RE = re.compile(r'\s*(статья\s+)?(\d{1,3})', re.IGNORECASE)
+_TOC_ARTICLE_RE = re.compile(r'\s*статья\s*$', re.IGNORECASE)
+_TOC_NUMBER_RE = re.compile(r'\s*(\d{1,3})')
+
+
+def _page_number_start(line):
+    """
+    :return: where the page number at the end of the line starts, -1 if there is no page number
+    """
+    end = len(line)
+    i = end
+    while i > 0 and end - i < 6 and line[i - 1].isdecimal():
+        i -= 1
+
+    if i == end or end - i > 5 or (i > 0 and not line[i - 1].isspace()):
+        return -1
+    return i
+
+
+class _TableOfContentsScanner:
+
+    def __init__(self, lines):
+        self.lines = lines
+        n = len(lines)
+
+        # next line with some text, at or after i
+        self.next_nonblank = [n] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            self.next_nonblank[i] = i if lines[i].strip() else self.next_nonblank[i + 1]
+
+        # last empty line at or before i
+        self.last_empty = [-1] * n
+        last = -1
+        for i in range(n):
+            if lines[i] == '':
+                last = i
+            self.last_empty[i] = last
+
+        # where the line starts in the text
+        self.offsets = [0] * (n + 1)
+        for i in range(n):
+            self.offsets[i + 1] = self.offsets[i] + len(lines[i]) + 1
+
+    def _entry_number_prefixes(self, i):
+        """
+        :return: the line with the entry number and the possible ends of the number in it: '12.' may be read as
+        '12.', '12' or '1'
+        """
+        line = self.lines[i]
+        if _TOC_ARTICLE_RE.match(line):
+            # 'Статья' on a line of its own
+            i = self.next_nonblank[i + 1]
+            if i >= len(self.lines):
+                return i, []
+            line = self.lines[i]
+            m = _TOC_NUMBER_RE.match(line)
+        else:
+            m = _TOC_ENTRY_NUMBER_RE.match(line)
+
+        if not m:
+            return i, []
+
+        number_start, number_end = m.span(m.lastindex)
+        prefixes = list(range(number_end, number_start, -1))
+        if number_end < len(line) and line[number_end] == '.':
+            prefixes.insert(0, number_end + 1)
+        return i, prefixes
+
+    def _spaces_between(self, i, j):
+        """
+        :return: count of chars (but line breaks) in the blank lines between lines i and j
+        """
+        return self.offsets[j] - self.offsets[i + 1] - (j - i - 1)
+
+    def _page_alone(self, i):
+        page = _page_number_start(self.lines[i])
+        return page >= 0 and not self.lines[i][:page].strip()
+
+    def entry_ends(self, i):
+        """
+        The title of an entry takes one or two lines; the page number ends the last of them or takes a line of
+        its own. Ends are listed in the order the original regex used to try them.
+        :return: possible last lines of the TOC entry starting at line i
+        """
+        if i >= len(self.lines):
+            return []
+
+        n = len(self.lines)
+        number_line, prefixes = self._entry_number_prefixes(i)
+
+        ends = []
+        for prefix_end in prefixes:
+            rest = self.lines[number_line][prefix_end:]
+            if rest.strip():
+                first = number_line
+                title_start = prefix_end + len(rest) - len(rest.lstrip())
+            else:
+                first = self.next_nonblank[number_line + 1]
+                if first >= n:
+                    continue
+                title_start = len(self.lines[first]) - len(self.lines[first].lstrip())
+
+            page = _page_number_start(self.lines[first])
+            if page >= title_start + 2:
+                ends.append(first)
+
+            second = self.next_nonblank[first + 1]
+            if second < n:
+                if self._page_alone(second):
+                    ends.append(second)
+
+                second_page = _page_number_start(self.lines[second])
+                if second_page >= 2 or (second_page >= 0 and self._spaces_between(first, second) > 0):
+                    ends.append(second)
+
+                third = self.next_nonblank[second + 1]
+                if third < n and self._page_alone(third):
+                    ends.append(third)
+
+            if page == title_start:
+                # no title, but the regex is fine with a title made of a single space
+                if first == number_line:
+                    spaces = page - prefix_end
+                else:
+                    spaces = len(rest) + self._spaces_between(number_line, first) + page
+                if spaces - (1 if page > 0 else 0) >= 1:
+                    ends.append(first)
+
+        return ends
+
+    def entry_gap(self, entry_end):
+        """
+        :return: the empty line or the line of dots closing the entry, None if there is none
+        """
+        nonblank = self.next_nonblank[entry_end + 1]
+        if nonblank < len(self.lines) and self.lines[nonblank].strip('.') == '':
+            return nonblank
+
+        empty = self.last_empty[nonblank - 1]
+        return empty if empty > entry_end else None
+
+    def entries_end(self, start):
+        """
+        :return: the line closing the chain of TOC entries starting at line start, None if there are no entries
+        """
+        block_end = None
+        while True:
+            gaps = (self.entry_gap(end) for end in self.entry_ends(start))
+            gap = next((g for g in gaps if g is not None), None)
+            if gap is None:
+                return block_end
+
+            block_end = gap
+            if self.lines[gap] != '':
+                # a line of dots closes the TOC
+                return block_end
+
+            start = self.next_nonblank[gap]
+
+    def block_end(self, heading_line, heading_end):
+        """
+        :param heading_end: where the heading word ends in the heading line
+        :return: the line the TOC under the heading ends with, None if there are no entries
+        """
+        first = self.next_nonblank[heading_line + 1]
+        if first >= len(self.lines):
+            return None
+
+        # the first line is rather a subtitle, like 'TABLE OF CONTENTS' or 'Статья   Стр.'
+        block_end = self.entries_end(self.next_nonblank[first + 1])
+        if block_end is None and (len(self.lines[heading_line]) > heading_end or first > heading_line + 1):
+            block_end = self.entries_end(first)
+
+        return block_end
+
+
+def remove_table_of_contents(text):
+    """
+    Removes tables of contents: a 'содержание' or 'оглавление' heading, an optional subtitle line and numbered
+    entries ending with page numbers ('1. Общие положения   3', 'Статья 2. ...   5'); the title of an entry
+    may wrap to the next line. Entries are separated by empty lines; a line of dots closes the TOC.
+    Removes the same text the former regex did, in linear time.
+    """
+    if not _TOC_HEADING_ANY_RE.search(text):
+        return text
+
+    lines = text.split('\n')
+    scanner = _TableOfContentsScanner(lines)
 
- 
+    result = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        m = _TOC_HEADING_RE.search(line)
+        block_end = scanner.block_end(i, m.end(1)) if m else None
+
+        if block_end is None:
+            result.append(line)
+            i += 1
+        else:
+            result.append(line[:m.start()])
+            i = block_end + 1
+
+    return '\n'.join(result)
+
+
+table_of_contents_regex = [
+    remove_table_of_contents
 ]
 
 # replacements_regex = dates_regex + abbreviation_regex + fixtures_regex + spaces_regex + syntax_regex + cleanup_regex + numbers_regex + formatting_regex
@@ -101,8 +315,155 @@ replacements_regex = table_of_contents_regex + dates_regex + abbreviation_regex
 
 def normalize_text(_t, replacements_regex):
     t = _t
-    for (reg, to) in replacements_regex:
-        t = reg.sub(to, t)
+    for rule in replacements_regex:
+        if callable(rule):
+            t = rule(t)
+        else:
+            (reg, to) = rule
+            t = reg.sub(to, t)
 
     return t
 
+
+# ----------------------------------------------------------------
+# FUSED RULES
+# a group of rules that do not interact (no rule matches or looks at text another one
+# of the group rewrites) is applied as one alternation in one pass
+# ----------------------------------------------------------------
+
+_REGEX_FLAGS = [(re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.VERBOSE, 'x')]
+_TEMPLATE_GROUP_REF = re.compile(r'\\(\d+)|\\g<(\d+)>')
+
+
+def _make_replacement(to, offset):
+    if callable(to):
+        return to
+
+    if '\\' not in to:
+        return lambda m: to
+
+    # group references of the rule are shifted by the position of the rule in the alternation
+    template = _TEMPLATE_GROUP_REF.sub(lambda g: '\\g<%d>' % (offset + int(g.group(1) or g.group(2))), to)
+    return lambda m: m.expand(template)
+
+
+_CATEGORIES = {
+    sre_parse.CATEGORY_DIGIT: r'\d',
+    sre_parse.CATEGORY_SPACE: r'\s',
+    sre_parse.CATEGORY_WORD: r'\w',
+}
+
+
+def _first_chars(parsed):
+    """
+    :return: (character class items a match can start with, can the match be empty);
+    None when it is hard to tell
+    """
+    chars = set()
+    for op, av in parsed:
+        if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT, sre_parse.AT):
+            continue  # zero-width
+
+        if op is sre_parse.LITERAL:
+            chars.add(re.escape(chr(av)))
+            return chars, False
+
+        if op is sre_parse.IN:
+            for item_op, item in av:
+                if item_op is sre_parse.LITERAL:
+                    chars.add(re.escape(chr(item)))
+                elif item_op is sre_parse.RANGE:
+                    chars.add(re.escape(chr(item[0])) + '-' + re.escape(chr(item[1])))
+                elif item_op is sre_parse.CATEGORY and item in _CATEGORIES:
+                    chars.add(_CATEGORIES[item])
+                else:
+                    return None
+            return chars, False
+
+        if op is sre_parse.SUBPATTERN:
+            alternatives, at_least_one = [av[-1]], 1
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            alternatives, at_least_one = [av[2]], av[0]
+        elif op is sre_parse.BRANCH:
+            alternatives, at_least_one = av[1], 1
+        else:
+            return None
+
+        nullable = False
+        for alternative in alternatives:
+            first = _first_chars(alternative)
+            if first is None:
+                return None
+            chars |= first[0]
+            nullable = nullable or first[1]
+
+        if at_least_one and not nullable:
+            return chars, False
+
+    return chars, True
+
+
+def _make_prefilter(group):
+    chars = set()
+    for reg, _ in group:
+        first = _first_chars(sre_parse.parse(reg.pattern, reg.flags))
+        if first is None or first[1] or reg.flags & re.IGNORECASE:
+            return ''
+        chars |= first[0]
+
+    return '(?=[%s])' % ''.join(sorted(chars))
+
+
+def fuse_regex(group):
+    """
+    :param group: [(compiled regex, replacement)], the rules must not interact
+    :return: (compiled alternation, dispatching callback), usable in normalize_text like any other rule
+    """
+    if len(group) == 1:
+        return group[0]
+
+    alternatives = []
+    for i, (reg, _) in enumerate(group):
+        flags = ''.join([f for (flag, f) in _REGEX_FLAGS if reg.flags & flag])
+        pattern = '(?%s:%s)' % (flags, reg.pattern) if flags else reg.pattern
+        alternatives.append('(?P<_r%d>%s)' % (i, pattern))
+
+    # lets the scan skip positions no rule can start at
+    fused = re.compile(_make_prefilter(group) + '(?:%s)' % '|'.join(alternatives))
+
+    replacements = {}
+    for i, (_, to) in enumerate(group):
+        name = '_r%d' % i
+        replacements[name] = _make_replacement(to, fused.groupindex[name])
+
+    def dispatch(m):
+        return replacements[m.lastgroup](m)
+
+    return fused, dispatch
+
+
+def fuse_regex_groups(groups):
+    return [fuse_regex(group) for group in groups if len(group) > 0]
+
+
+# replacements_regex, same order, split where a rule sees the output of a previous one
+fused_replacements_regex = fuse_regex_groups([
+    table_of_contents_regex,
+    # '(?<=[А-Я])\n' would see 'ООО' before its expansion
+    dates_regex + abbreviation_regex + fixtures_regex[:1],
+    # '[ ]{2}' collapses spaces made of tabs
+    fixtures_regex[1:] + spaces_regex[:1],
+    spaces_regex[1:] + syntax_regex[:1],
+    # matches empty strings, so it would disable the prefilter of its group
+    syntax_regex[1:2],
+    # '\s+\.' eats spaces '[ ]{2}' would collapse first
+    syntax_regex[2:4],
+    syntax_regex[4:5],
+    # '(?<=[ ])г\.' matches the output of '(?<=\d)+г\.'
+    syntax_regex[5:7],
+    syntax_regex[7:9],
+    # the second numbers rule looks ahead over digits the first one joins
+    syntax_regex[9:] + numbers_regex[:1],
+    numbers_regex[1:] + formatting_regex
+])
+
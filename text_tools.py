@@ -3,16 +3,54 @@
 # coding=utf-8
 
 
+import os
+import re
+from functools import lru_cache
 from typing import List
 
 import nltk
 import numpy as np
 import scipy.spatial.distance as distance
 
-nltk.download('punkt')
-
 Tokens = List[str]
 
+# ----------------------------------------------------------------
+# NLTK DATA
+# nothing is downloaded at import time: put punkt and the Russian punkt
+# into $NLP_TOOLS_NLTK_DATA once, e.g. with download_nltk_data()
+# ----------------------------------------------------------------
+
+NLTK_DATA_DIR_ENV = 'NLP_TOOLS_NLTK_DATA'
+NLTK_DATA_DIR = os.environ.get(NLTK_DATA_DIR_ENV, 'nltk_data_download')
+if NLTK_DATA_DIR not in nltk.data.path:
+  nltk.data.path.insert(0, NLTK_DATA_DIR)
+
+RUSSIAN_PUNKT_URL = 'https://github.com/Mottl/ru_punkt/raw/master/nltk_data/tokenizers/punkt/PY3/russian.pickle'
+RUSSIAN_PUNKT_PATH = 'tokenizers/punkt/PY3/russian.pickle'
+
+
+def download_nltk_data(data_dir=NLTK_DATA_DIR):
+  """
+  Fetches punkt and the Russian punkt (https://github.com/Mottl/ru_punkt) into data_dir.
+  Needs network access, so call it when provisioning, not on every start.
+  """
+  import urllib.request
+
+  nltk.download('punkt', download_dir=data_dir)
+
+  path = os.path.join(data_dir, RUSSIAN_PUNKT_PATH)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  with urllib.request.urlopen(RUSSIAN_PUNKT_URL) as russian_punkt, open(path, 'wb') as output:
+    output.write(russian_punkt.read())
+
+
+@lru_cache(maxsize=1)
+def get_ru_tokenizer():
+  """
+  Russian punkt sentence tokenizer; loaded from NLTK_DATA_DIR on first use
+  """
+  return nltk.data.load('file:' + os.path.abspath(os.path.join(NLTK_DATA_DIR, RUSSIAN_PUNKT_PATH)))
+
 
 def find_ner_end(tokens, start, max_len=20):
   for i in range(start, len(tokens)):
@@ -37,7 +75,7 @@ def find_ner_end(tokens, start, max_len=20):
 def to_float(str):
   try:
     return float(str.replace(" ", "").replace(",", "."))
-  except:
+  except Exception:
     return np.nan
 
 
@@ -66,6 +104,88 @@ def tokenize_text(text):
   return result
 
 
+# ----------------------------------------------------------------
+# FAST TOKENIZER
+# the same token stream as tokenize_text (nltk.word_tokenize per line),
+# the Treebank rules are folded into one regex
+# ----------------------------------------------------------------
+
+_TB_WORD = r'(?:[^\s.,:;@#$%&?!*\[\](){}<>«“‘„»”’"\-]|[:,](?=\d)|-(?!-)|\.(?!\.))+'
+_TB_TOKEN_RE = re.compile(r'\.{2,}|--|[:,](?!\d)|"|[;@#$%&?!*\[\](){}<>«“‘„»”’]|' + _TB_WORD)
+
+# the final period of a sentence is a separate token (Treebank PUNCTUATION rule)
+_TB_FINAL_PERIOD_RE = re.compile(r'[^.](\.)([\]\)}>"»”’ ]*)\s*$')
+
+# a double quote is an opening one (``) after these, a closing one ('') otherwise
+_TB_OPENING_QUOTE_PREV = ' ([{<«“‘„'
+
+# possible punkt sentence breaks inside a line (punkt period context)
+_PUNKT_CANDIDATE_RE = re.compile(r'[.?!](?:[)";}\]*:@\'({\[!?]|\s+\S)')
+
+# apostrophes, backticks and English contractions: left to nltk
+_TB_FALLBACK_RE = re.compile(r"['`]|[:,][:,]|\"\"|(?i:\b(?:cannot|gimme|gonna|gotta|lemme|wanna)\b)")
+
+
+@lru_cache(maxsize=1)
+def _get_punkt_tokenizer():
+  # the sentence tokenizer used by nltk.word_tokenize
+  return nltk.data.load('tokenizers/punkt/english.pickle')
+
+
+def _tokenize_sentence_fast(sentence: str, result: Tokens):
+  final_period = -1
+  m = _TB_FINAL_PERIOD_RE.search(sentence)
+  if m and ' "' not in m.group(2):
+    final_period = m.start(1)
+
+  for m in _TB_TOKEN_RE.finditer(sentence):
+    token = m.group()
+    start = m.start()
+
+    if token == '"':
+      if start == 0 or sentence[start - 1] in _TB_OPENING_QUOTE_PREV:
+        result.append('``')
+      else:
+        result.append("''")
+
+    elif m.end() - 1 == final_period and len(token) > 1:
+      result.append(token[:-1])
+      result.append('.')
+
+    else:
+      result.append(token)
+
+
+def tokenize_line_fast(line: str) -> Tokens:
+  if _TB_FALLBACK_RE.search(line):
+    return nltk.word_tokenize(line)
+
+  result = []
+  if _PUNKT_CANDIDATE_RE.search(line):
+    for start, end in _get_punkt_tokenizer().span_tokenize(line):
+      _tokenize_sentence_fast(line[start:end], result)
+  else:
+    _tokenize_sentence_fast(line.rstrip(), result)
+
+  return result
+
+
+def tokenize_text_fast(text: str) -> Tokens:
+  """
+  Regex replacement of tokenize_text: the same tokens, '\\n' included.
+  Punkt is only consulted for lines with a possible sentence break in the middle,
+  lines with apostrophes or backticks go to nltk.word_tokenize.
+  """
+  result = []
+  lines = text.split('\n')
+  for i in range(len(lines)):
+    result += tokenize_line_fast(lines[i])
+    if i < len(lines) - 1:
+      result.append('\n')
+
+  return result
+
+
 # ----------------------------------------------------------------
 # DISTANCES
 # ----------------------------------------------------------------
@@ -162,6 +282,408 @@ def dist_cosine_housedorff_undirected(u, v):
   return round((d1 + d2) / 2, 2)
 
 
+# ----------------------------------------------------------------
+# SLIDING WINDOW DISTANCES
+# ----------------------------------------------------------------
+
+def dist_mean_cosine_sliding_window(text_emb, pattern_emb, window_size: int, block_size=4096):
+  """
+  Vectorized equivalent of
+
+    for i in range(len(text_emb)):
+      distances[i] = dist_mean_cosine(text_emb[i: i + window_size], pattern_emb)
+
+  (windows get shorter at the end of the text, just like slices do).
+  """
+  pattern_mean = np.asarray(pattern_emb, dtype=np.float64).mean(0)
+  return dist_mean_cosine_sliding_window_multi(text_emb, [pattern_mean], window_size, block_size)[:, 0]
+
+
+def dist_mean_cosine_sliding_window_multi(text_emb, patterns_means, window_size: int, block_size=4096):
+  """
+  Mean-cosine distances from every sliding window of the text to every pattern of the same window size.
+
+  Window sums are taken from cumulative sums over the embeddings, then all windows
+  are compared to all pattern means with a single matrix product.
+  The text is processed in blocks of `block_size` windows, so the float64 cumsum buffer
+  stays at (block_size + window_size) x dim.
+
+  :param text_emb: tokens x dim
+  :param patterns_means: patterns x dim, mean embedding of each pattern
+  :return: tokens x patterns matrix of distances
+  """
+  assert window_size > 0
+
+  n = len(text_emb)
+  patterns_means = np.asarray(patterns_means, dtype=np.float64)
+  patterns_norms = np.linalg.norm(patterns_means, axis=1)
+
+  distances = np.ones((n, len(patterns_means)))
+
+  for block_start in range(0, n, block_size):
+    block_end = min(n, block_start + block_size)
+    rows_end = min(n, block_end - 1 + window_size)
+
+    cumsum = np.zeros((rows_end - block_start + 1, patterns_means.shape[1]))
+    np.cumsum(np.asarray(text_emb[block_start:rows_end], dtype=np.float64), axis=0, out=cumsum[1:])
+
+    starts = np.arange(block_start, block_end)
+    stops = np.minimum(starts + window_size, n)
+
+    # cosine is scale-invariant, so window sums do as well as window means
+    window_sums = cumsum[stops - block_start] - cumsum[starts - block_start]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+      cos = window_sums.dot(patterns_means.T) / np.outer(np.linalg.norm(window_sums, axis=1), patterns_norms)
+
+    distances[block_start:block_end] = np.abs(1.0 - cos)
+
+  return distances
+
+
+def normalize_rows(emb, dtype=np.float32):
+  """
+  :return: a copy of emb with every row scaled to unit length (zero rows become nan, like cdist 'cosine' makes them)
+  """
+  emb = np.array(emb, dtype=dtype)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    emb /= np.sqrt(np.einsum('ij,ij->i', emb, emb))[:, None]
+  return emb
+
+
+class RowsNormalizedOnRead:
+  """
+  normalize_rows of np.memmap-backed embeddings, done for the rows being read only:
+  a normalized copy of the whole document is never held in memory
+  """
+
+  def __init__(self, emb):
+    self.emb = emb
+
+  def __len__(self):
+    return len(self.emb)
+
+  def __getitem__(self, rows):
+    return normalize_rows(self.emb[rows])
+
+
+def normalize_text_rows(text_emb):
+  """
+  normalize_rows of the document embeddings for the kernels of TEXT_NORM_DIST_FUNCTIONS; normalize once per document
+  and pass it as text_norm to all the patterns. Memory-mapped embeddings are normalized block by block, as the kernels
+  read them.
+  """
+  if isinstance(text_emb, np.memmap):
+    return RowsNormalizedOnRead(text_emb)
+  return normalize_rows(text_emb)
+
+
+def dist_cosine_min_reductions_sliding_window_multi(text_norm, patterns_norm, window_size: int, reduce=np.add,
+                                                    block_size=4096):
+  """
+  For every sliding window W = text[i: i + window_size] (shorter at the end of the text) and every pattern P[j]
+  of the same length, with D = distance.cdist(W, P[j], 'cosine'), computes
+
+    pattern_to_window[i, j] = reduce(D.min(0))   # every pattern word to the nearest word of the window
+    window_to_pattern[i, j] = reduce(D.min(1))   # every window word to the nearest pattern word
+
+  Word-to-pattern distances come from a single dot product per block of `block_size` windows (all the patterns
+  stacked), written into one (block_size + window_size - 1) x (patterns x pattern words) buffer; the window
+  minimums are taken over strided views of it.
+
+  :param text_norm: tokens x dim, rows of unit length (see normalize_rows, RowsNormalizedOnRead)
+  :param patterns_norm: patterns x pattern words x dim, rows of unit length
+  :param reduce: np.add or np.maximum
+  :return: pattern_to_window, window_to_pattern: float32, len(text_norm) x patterns
+  """
+  assert window_size > 0
+
+  sliding_window_view = np.lib.stride_tricks.sliding_window_view
+
+  patterns_norm = np.asarray(patterns_norm, dtype=np.float32)
+  k, m, dim = patterns_norm.shape
+  n = len(text_norm)
+  identity = 0 if reduce is np.add else -np.inf
+
+  pattern_to_window = np.zeros((n, k), dtype=np.float32)
+  window_to_pattern = np.zeros((n, k), dtype=np.float32)
+
+  patterns_t = np.ascontiguousarray(patterns_norm.reshape(k * m, dim).T)
+  buffer = np.empty((min(n, block_size) + window_size - 1, k * m), dtype=np.float32)
+
+  for block_start in range(0, n, block_size):
+    block_end = min(n, block_start + block_size)
+    rows = min(n, block_end - 1 + window_size) - block_start
+
+    d = buffer[:block_end - block_start + window_size - 1]
+    np.dot(text_norm[block_start:block_start + rows], patterns_t, out=d[:rows])
+    np.subtract(1, d[:rows], out=d[:rows])
+    np.clip(d[:rows], 0, 2, out=d[:rows])
+    d[rows:] = np.inf  # past the end of the text: windows get shorter
+
+    words_min = d.reshape(len(d), k, m).min(2)
+    words_min[rows:] = identity
+
+    windows = block_end - block_start
+    windows_min = sliding_window_view(d, window_size, axis=0)[:windows].min(-1)
+    reduce.reduce(windows_min.reshape(windows, k, m), axis=2, out=pattern_to_window[block_start:block_end])
+    reduce.reduce(sliding_window_view(words_min, window_size, axis=0)[:windows], axis=-1,
+                  out=window_to_pattern[block_start:block_end])
+
+  return pattern_to_window, window_to_pattern
+
+
+def dist_cosine_min_reductions_sliding_window(text_norm, pattern_norm, window_size: int, reduce=np.add,
+                                              block_size=4096):
+  """
+  dist_cosine_min_reductions_sliding_window_multi for one pattern (pattern words x dim)
+
+  :return: pattern_to_window, window_to_pattern: float32 vectors of len(text_norm)
+  """
+  d1, d2 = dist_cosine_min_reductions_sliding_window_multi(text_norm, [pattern_norm], window_size, reduce, block_size)
+  return d1[:, 0], d2[:, 0]
+
+
+def _min_reductions_multi(text_emb, patterns_emb, window_size: int, reduce, text_norm=None):
+  if text_norm is None:
+    text_norm = normalize_text_rows(text_emb)
+  patterns_norm = [normalize_rows(p) for p in patterns_emb]
+  return dist_cosine_min_reductions_sliding_window_multi(text_norm, patterns_norm, window_size, reduce)
+
+
+def dist_frechet_cosine_sliding_window_multi(text_emb, patterns_emb, window_size: int, directed=False,
+                                             text_norm=None):
+  """
+  dist_frechet_cosine_undirected (or _directed) of every sliding window of the text to every pattern
+  of the same length, see dist_cosine_min_reductions_sliding_window_multi
+
+  :param patterns_emb: patterns x pattern words x dim
+  :param text_norm: normalize_text_rows(text_emb), if already computed
+  :return: tokens x patterns
+  """
+  d1, d2 = _min_reductions_multi(text_emb, patterns_emb, window_size, np.add, text_norm)
+  if directed:
+    return d1
+  return np.round((d1 + d2) / 2, 2)
+
+
+def dist_cosine_housedorff_sliding_window_multi(text_emb, patterns_emb, window_size: int, directed=False,
+                                                text_norm=None):
+  """
+  dist_cosine_housedorff_undirected (or _directed) of every sliding window of the text to every pattern
+  of the same length, see dist_cosine_min_reductions_sliding_window_multi
+  """
+  d1, d2 = _min_reductions_multi(text_emb, patterns_emb, window_size, np.maximum, text_norm)
+  if directed:
+    return d1
+  return np.round((d1 + d2) / 2, 2)
+
+
+def dist_cosine_min_mean_sliding_window_multi(text_emb, patterns_emb, window_size: int, text_norm=None):
+  """
+  dist_cosine_min_mean of every sliding window of the text to every pattern of the same length:
+  the words of the shorter one go to the nearest words of the longer one
+  """
+  d1, d2 = _min_reductions_multi(text_emb, patterns_emb, window_size, np.add, text_norm)
+  m = len(patterns_emb[0])
+  n = len(text_emb)
+  windows_lens = np.minimum(window_size, n - np.arange(n))[:, None]
+  return np.where(windows_lens > m, d1 / m, d2 / windows_lens)
+
+
+def dist_frechet_cosine_sliding_window(text_emb, pattern_emb, window_size: int, directed=False, text_norm=None):
+  """
+  dist_frechet_cosine_undirected (or _directed) of every sliding window of the text to the pattern,
+  see dist_cosine_min_reductions_sliding_window
+
+  :param text_norm: normalize_text_rows(text_emb), if already computed
+  """
+  return dist_frechet_cosine_sliding_window_multi(text_emb, [pattern_emb], window_size, directed, text_norm)[:, 0]
+
+
+def dist_cosine_housedorff_sliding_window(text_emb, pattern_emb, window_size: int, directed=False, text_norm=None):
+  """
+  dist_cosine_housedorff_undirected (or _directed) of every sliding window of the text to the pattern,
+  see dist_cosine_min_reductions_sliding_window
+
+  :param text_norm: normalize_text_rows(text_emb), if already computed
+  """
+  return dist_cosine_housedorff_sliding_window_multi(text_emb, [pattern_emb], window_size, directed, text_norm)[:, 0]
+
+
+def dist_cosine_min_mean_sliding_window(text_emb, pattern_emb, window_size: int, text_norm=None):
+  """
+  dist_cosine_min_mean of every sliding window of the text to the pattern:
+  the words of the shorter one go to the nearest words of the longer one
+
+  :param text_norm: normalize_text_rows(text_emb), if already computed
+  """
+  return dist_cosine_min_mean_sliding_window_multi(text_emb, [pattern_emb], window_size, text_norm)[:, 0]
+
+
+"""
+Distance functions having a vectorized sliding-window implementation:
+  dist_function -> kernel(text_emb, pattern_emb, window_size)
+"""
+SLIDING_WINDOW_KERNELS = {
+  dist_mean_cosine: dist_mean_cosine_sliding_window,
+  dist_frechet_cosine_undirected: dist_frechet_cosine_sliding_window,
+  dist_frechet_cosine_directed: lambda t, p, window_size, text_norm=None: dist_frechet_cosine_sliding_window(
+    t, p, window_size, True, text_norm),
+  dist_cosine_housedorff_undirected: dist_cosine_housedorff_sliding_window,
+  dist_cosine_housedorff_directed: lambda t, p, window_size, text_norm=None: dist_cosine_housedorff_sliding_window(
+    t, p, window_size, True, text_norm),
+  dist_cosine_min_mean: dist_cosine_min_mean_sliding_window
+}
+
+"""
+Distance functions having a vectorized implementation for many patterns of the same length at once:
+  dist_function -> kernel(text_emb, patterns_emb, window_size), patterns_emb: patterns x pattern words x dim;
+  returns tokens x patterns
+"""
+SLIDING_WINDOW_MULTI_KERNELS = {
+  dist_mean_cosine: lambda t, patterns, window_size: dist_mean_cosine_sliding_window_multi(
+    t, [np.asarray(p, dtype=np.float64).mean(0) for p in patterns], window_size),
+  dist_frechet_cosine_undirected: dist_frechet_cosine_sliding_window_multi,
+  dist_frechet_cosine_directed: lambda t, p, window_size, text_norm=None: dist_frechet_cosine_sliding_window_multi(
+    t, p, window_size, True, text_norm),
+  dist_cosine_housedorff_undirected: dist_cosine_housedorff_sliding_window_multi,
+  dist_cosine_housedorff_directed: lambda t, p, window_size, text_norm=None: dist_cosine_housedorff_sliding_window_multi(
+    t, p, window_size, True, text_norm),
+  dist_cosine_min_mean: dist_cosine_min_mean_sliding_window_multi
+}
+
+"""
+Distance functions whose SLIDING_WINDOW_KERNELS and SLIDING_WINDOW_MULTI_KERNELS also take
+text_norm=normalize_text_rows(text_emb)
+"""
+TEXT_NORM_DIST_FUNCTIONS = {
+  dist_frechet_cosine_undirected, dist_frechet_cosine_directed,
+  dist_cosine_housedorff_undirected, dist_cosine_housedorff_directed,
+  dist_cosine_min_mean
+}
+
+
+# ----------------------------------------------------------------
+# PAIRWISE DISTANCES
+# ----------------------------------------------------------------
+
+def dist_mean_cosine_pairwise(sentences):
+  """
+  Vectorized equivalent of dist_mean_cosine(u, v) (and dist_sum_cosine) for every pair of sentences:
+  cosine is scale-invariant, so one Gram matrix of the normalized sentence means does for both.
+
+  :param sentences: list of (tokens x dim) embeddings, or a sentences x tokens x dim tensor
+  :return: sentences x sentences matrix of distances
+  """
+  means = np.array([np.asarray(s, dtype=np.float64).mean(0) for s in sentences])
+  norms = np.linalg.norm(means, axis=1)
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    mtx = 1.0 - means.dot(means.T) / np.outer(norms, norms)
+
+  # like distance.cosine: clipped to [0, 2], zero vectors are at 0 from anything
+  mtx = np.clip(mtx, 0.0, 2.0)
+  mtx[np.isnan(mtx)] = 0.0
+  return mtx
+
+
+def _cosine_min_reductions(sentences, reduce, max_block_elements=2 ** 22):
+  """
+  For every pair of sentences (u, v), with D = distance.cdist(u, v, 'cosine'), computes
+
+    directed[u, v] = reduce(D.min(0))   # every word of v to the nearest word of u
+
+  All words of all sentences are normalized and stacked once. D is symmetric, so only
+  its upper part is computed: for blocks of sentences holding at most `max_block_elements`
+  distances to the words of themselves and of the sentences after them,
+  reduced by sentence with ufunc.reduceat in both directions.
+
+  :param reduce: np.add or np.maximum
+  :return: sentences x sentences matrix
+  """
+  lens = np.array([len(s) for s in sentences])
+  assert lens.min() > 0, 'empty sentence'
+
+  words = np.concatenate([np.asarray(s, dtype=np.float64) for s in sentences])
+  with np.errstate(divide='ignore', invalid='ignore'):
+    words = words / np.linalg.norm(words, axis=1, keepdims=True)
+
+  starts = np.concatenate(([0], np.cumsum(lens)[:-1]))
+  n = len(sentences)
+
+  directed = np.zeros((n, n))
+
+  block_start = 0
+  while block_start < n:
+    # as many sentences as fit the budget, at least one
+    block_words = np.cumsum(lens[block_start:]) * (len(words) - starts[block_start])
+    block_end = block_start + max(1, int(np.searchsorted(block_words, max_block_elements, side='right')))
+
+    offset = starts[block_start]
+    row_starts = starts[block_start:block_end] - offset
+    col_starts = starts[block_start:] - offset
+
+    d = np.clip(1.0 - words[offset:offset + lens[block_start:block_end].sum()].dot(words[offset:].T), 0.0, 2.0)
+
+    directed[block_start:block_end, block_start:] = reduce.reduceat(
+      np.minimum.reduceat(d, row_starts, axis=0), col_starts, axis=1)
+    directed[block_start:, block_start:block_end] = reduce.reduceat(
+      np.minimum.reduceat(d, col_starts, axis=1), row_starts, axis=0).T
+
+    block_start = block_end
+
+  return directed
+
+
+def dist_frechet_cosine_pairwise(sentences, directed=False):
+  """
+  dist_frechet_cosine_undirected (or _directed) for every pair of sentences, see _cosine_min_reductions
+  """
+  d = _cosine_min_reductions(sentences, np.add)
+  if directed:
+    return d
+  return np.round((d + d.T) / 2, 2)
+
+
+def dist_cosine_housedorff_pairwise(sentences, directed=False):
+  """
+  dist_cosine_housedorff_undirected (or _directed) for every pair of sentences, see _cosine_min_reductions
+  """
+  d = _cosine_min_reductions(sentences, np.maximum)
+  if directed:
+    return d
+  return np.round((d + d.T) / 2, 2)
+
+
+def dist_cosine_min_mean_pairwise(sentences):
+  """
+  dist_cosine_min_mean for every pair of sentences: the words of the shorter one
+  (of v, when both are of the same length) go to the nearest words of the longer one
+  """
+  d = _cosine_min_reductions(sentences, np.add)
+  lens = np.array([len(s) for s in sentences])
+
+  # d[u, v] sums over the words of v, d.T[u, v] over the words of u
+  u_longer = lens[:, None] > lens[None, :]
+  return np.where(u_longer, d / lens[None, :], d.T / lens[:, None])
+
+
+"""
+Distance functions having a vectorized implementation for all pairs of sentences:
+  dist_function -> kernel(sentences)
+"""
+PAIRWISE_KERNELS = {
+  dist_mean_cosine: dist_mean_cosine_pairwise,
+  dist_sum_cosine: dist_mean_cosine_pairwise,
+  dist_frechet_cosine_undirected: dist_frechet_cosine_pairwise,
+  dist_frechet_cosine_directed: lambda sentences: dist_frechet_cosine_pairwise(sentences, directed=True),
+  dist_cosine_housedorff_undirected: dist_cosine_housedorff_pairwise,
+  dist_cosine_housedorff_directed: lambda sentences: dist_cosine_housedorff_pairwise(sentences, directed=True),
+  dist_cosine_min_mean: dist_cosine_min_mean_pairwise
+}
+
+
 # ----------------------------------------------------------------
 # MISC
 # ----------------------------------------------------------------
@@ -190,11 +712,18 @@ def min_index(sums):
 # ----------------------------------------------------------------
 
 def sentence_similarity_matrix(emb, distance_function):
-  mtx = np.zeros(shape=(emb.shape[0], emb.shape[0]))
-
-  # TODO: write it Pythonish!!
-  for u in range(emb.shape[0]):
-    for v in range(emb.shape[0]):
+  """
+  :param emb: sentences x tokens x dim tensor, or a list of (tokens x dim) sentence embeddings
+  :param distance_function: dist_*(u, v); the ones in PAIRWISE_KERNELS are computed for all pairs at once
+  :return: sentences x sentences matrix of distance_function(emb[u], emb[v])
+  """
+  if distance_function in PAIRWISE_KERNELS and len(emb) > 0 and np.ndim(emb[0]) == 2:
+    return PAIRWISE_KERNELS[distance_function](emb)
+
+  mtx = np.zeros(shape=(len(emb), len(emb)))
+
+  for u in range(len(emb)):
+    for v in range(len(emb)):
       mtx[u, v] = distance_function(emb[u], emb[v])
 
   # TODO: no norm here
@@ -222,15 +751,44 @@ def find_token_after_index(tokens, index, token, default_ret=-1):
   return default_ret
 
 
-def get_sentence_bounds_at_index(index, tokens):
-  start = find_token_before_index(tokens, index, '\n', 0)
-  end = find_token_after_index(tokens, index, '\n', len(tokens) - 1)
+def find_newlines(tokens) -> np.ndarray:
+  """
+  :return: sorted indexes of '\n' tokens, to look sentence bounds up with np.searchsorted
+  """
+  return np.array([i for i, t in enumerate(tokens) if t == '\n'], dtype=int)
+
+
+def _newlines_around(index, newlines, default_before, default_after):
+  """
+  same as find_token_before_index & find_token_after_index for '\n', in O(log n)
+  """
+  k = int(np.searchsorted(newlines, index))
+  before = int(newlines[k - 1]) if k > 0 else default_before
+  after = int(newlines[k]) if k < len(newlines) else default_after
+  return before, after
+
+
+def get_sentence_bounds_at_index(index, tokens, newlines=None):
+  """
+  :param newlines: find_newlines(tokens); if given, bounds are looked up instead of scanning the tokens
+  """
+  if newlines is None:
+    start = find_token_before_index(tokens, index, '\n', 0)
+    end = find_token_after_index(tokens, index, '\n', len(tokens) - 1)
+  else:
+    start, end = _newlines_around(index, newlines, 0, len(tokens) - 1)
   return start + 1, end
 
 
-def get_sentence_slices_at_index(index, tokens) -> slice:
-  start = find_token_before_index(tokens, index, '\n')
-  end = find_token_after_index(tokens, index, '\n')
+def get_sentence_slices_at_index(index, tokens, newlines=None) -> slice:
+  """
+  :param newlines: find_newlines(tokens); if given, bounds are looked up instead of scanning the tokens
+  """
+  if newlines is None:
+    start = find_token_before_index(tokens, index, '\n')
+    end = find_token_after_index(tokens, index, '\n')
+  else:
+    start, end = _newlines_around(index, newlines, -1, -1)
   if start < 0:
     start = 0
   if end < 0:
@@ -238,6 +796,18 @@ def get_sentence_slices_at_index(index, tokens) -> slice:
   return slice(start + 1, end)
 
 
+def get_sentence_slices(tokens, newlines=None):
+  """
+  all the sentence slices get_sentence_slices_at_index gives, in order; the first one starts at 1, as there
+  :return: starts, ends
+  """
+  if newlines is None:
+    newlines = find_newlines(tokens)
+  starts = np.concatenate(([1], newlines + 1))
+  ends = np.append(newlines, len(tokens))
+  return starts, ends
+
+
 def min_index_per_row(rows):
   indexes = []
   for row in rows: